@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Batch solver for Sokoban levels.
+
+Solves a set of levels with one solver configuration, several levels at a time, and
+writes one JSON line per level as soon as it finishes (so the output can be streamed
+into other tools or a file while the batch is still running).
+
+Usage:
+  python batch_solve.py                                  (all of PROBLEMS, default configuration)
+  python batch_solve.py --levels 0-9 19 --workers 4      (PROBLEMS 0 to 9 and 19, 4 at a time)
+  python batch_solve.py --algorithm iterative_astar --heuristic heur_alternate --weight 2 --timebound 10
+  python batch_solve.py --output results.jsonl
+  python batch_solve.py --collection levels.xsb --levels 0-99   (levels of an XSB collection file, see levels.py)
+
+Each line is a JSON object with the keys:
+    level (int): the index of the level in PROBLEMS (or in the collection)
+    algorithm, heuristic, weight, timebound: the solver configuration
+    status (str): 'solved', 'unsolved' (no solution within the timebound), 'killed' (the
+        task overran its time limit and was terminated) or 'error'
+    solution_length (int or null): the number of moves of the solution found
+    stats (object or null): the fields of the SearchStats of the search
+    time (float): the elapsed (wall clock) time of the task in seconds
+    error (str, 'error' only): the traceback of the exception the solver raised
+
+The solver gets --timebound seconds of CPU time (which is what the algorithms measure) and
+a task that has used --grace seconds more than that is terminated. The limit is enforced with
+RLIMIT_CPU, so tasks are not cut short when there are more workers than CPUs; where the
+resource module is not available, the task is terminated after that much elapsed time instead.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+import solution
+from levels import LevelCollection
+from sokoban import PROBLEMS
+
+ALGORITHMS = ['weighted_astar', 'iterative_astar', 'iterative_arastar', 'iterative_gbfs']
+
+
+#######################################
+# UTILITIES
+#######################################
+def parse_levels(specs, count):
+    """Turn level specifications like '3' or '0-9' (inclusive) into a sorted list of indices below count."""
+    levels = set()
+    for spec in specs:
+        first, _, last = spec.partition('-')
+        levels.update(range(int(first), int(last or first) + 1))
+    for level in levels:
+        if not 0 <= level < count:
+            raise argparse.ArgumentTypeError("no such level: %d (there are %d)" % (level, count))
+    return sorted(levels)
+
+
+def solve(level, algorithm, heuristic, weight, timebound, collection=None):
+    """Solve one level with the given configuration and return its result line (without 'time')."""
+    result = dict(level=level, algorithm=algorithm, heuristic=heuristic, weight=weight, timebound=timebound)
+    algorithm_fn = getattr(solution, algorithm)
+    heur_fn = getattr(solution, heuristic)
+    try:
+        initial_state = LevelCollection(collection)[level] if collection else PROBLEMS[level]
+        if algorithm == 'iterative_gbfs':
+            final, stats = algorithm_fn(initial_state, heur_fn, timebound=timebound)
+        else:
+            final, stats = algorithm_fn(initial_state, heur_fn, weight, timebound)
+    except Exception:
+        result.update(status='error', solution_length=None, stats=None, error=traceback.format_exc())
+        return result
+    result.update(status='solved' if final else 'unsolved',
+                  solution_length=final.gval if final else None,
+                  stats=vars(stats) if stats else None)
+    return result
+
+
+def _worker(level, configuration, results, limit):
+    if resource is not None:
+        # the kernel kills the process (SIGXCPU) once it has used this much CPU time
+        used = sum(os.times()[:2])
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        soft = math.ceil(used + limit)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+    # the solvers print progress messages; keep stdout for the JSON lines
+    sys.stdout = open(os.devnull, 'w')
+    results.put(solve(level, *configuration))
+
+
+#######################################
+# MAIN FUNCTION
+#######################################
+def main():
+    parser = argparse.ArgumentParser(description="Solve Sokoban levels in parallel, one JSON line per level.")
+    parser.add_argument("--levels", "-l", nargs="+",
+                        help="Levels to solve, as indices or inclusive ranges such as 0-9 (default: all)")
+    parser.add_argument("--collection", "-c",
+                        help="Solve the levels of this XSB collection file instead of PROBLEMS")
+    parser.add_argument("--algorithm", "-a", choices=ALGORITHMS, default="weighted_astar",
+                        help="The search algorithm of solution.py to use (default: weighted_astar)")
+    parser.add_argument("--heuristic", default="heur_alternate",
+                        help="The heuristic of solution.py to use (default: heur_alternate)")
+    parser.add_argument("--weight", "-w", type=float, default=5,
+                        help="The weight for the algorithm (default: 5, ignored by iterative_gbfs)")
+    parser.add_argument("--timebound", "-t", type=float, default=5,
+                        help="Seconds the algorithm may search on each level (default: 5)")
+    parser.add_argument("--grace", type=float, default=2,
+                        help="Seconds a task may overrun its timebound before it is terminated (default: 2)")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count() or 1,
+                        help="The number of levels solved at the same time (default: one per CPU)")
+    parser.add_argument("--output", "-o", help="Write the JSON lines to this file instead of stdout")
+    args = parser.parse_args()
+
+    count = len(PROBLEMS)
+    if args.collection:
+        try:
+            # also builds the collection's index once, before the workers use it
+            count = len(LevelCollection(args.collection))
+        except OSError as error:
+            parser.error("can't read --collection: %s" % error)
+    try:
+        levels = parse_levels(args.levels, count) if args.levels else list(range(count))
+    except (ValueError, argparse.ArgumentTypeError) as error:
+        parser.error("invalid --levels: %s" % error)
+    if not callable(getattr(solution, args.heuristic, None)):
+        parser.error("no heuristic named %s in solution.py" % args.heuristic)
+    configuration = (args.algorithm, args.heuristic, args.weight, args.timebound, args.collection)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    results = multiprocessing.Queue()
+    pending = list(levels)
+    running = dict()  # level -> (process, start time)
+
+    def emit(result, start):
+        result['time'] = time.monotonic() - start
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+    def killed(level, start):
+        emit(dict(level=level, algorithm=args.algorithm, heuristic=args.heuristic, weight=args.weight,
+                  timebound=args.timebound, status='killed', solution_length=None, stats=None), start)
+
+    limit = args.timebound + args.grace
+    try:
+        while pending or running:
+            while pending and len(running) < args.workers:
+                level = pending.pop(0)
+                process = multiprocessing.Process(target=_worker, args=(level, configuration, results, limit),
+                                                  daemon=True)
+                process.start()
+                running[level] = (process, time.monotonic())
+
+            # a task that ended before the results are read has put its result (if any) on the queue by now
+            ended = [level for level, (process, _) in running.items() if not process.is_alive()]
+            block = True
+            while True:
+                try:
+                    result = results.get(timeout=0.1) if block else results.get_nowait()
+                except queue.Empty:
+                    break
+                block = False
+                # (a task may have reported just before it was terminated)
+                if result['level'] in running:
+                    process, start = running.pop(result['level'])
+                    process.join()
+                    emit(result, start)
+            for level in ended:
+                if level in running:
+                    process, start = running.pop(level)
+                    process.join()
+                    killed(level, start)
+
+            if resource is None:
+                now = time.monotonic()
+                for level, (process, start) in list(running.items()):
+                    if now - start > limit:
+                        process.terminate()
+                        process.join()
+                        del running[level]
+                        killed(level, start)
+    finally:
+        for process, _ in running.values():
+            process.terminate()
+            process.join()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
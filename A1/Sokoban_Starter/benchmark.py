@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Regression benchmarks for the Sokoban search engine.
+
+Runs a fixed matrix of (strategy, heuristic, level) cases over PROBLEMS, each case several
+times and each run in a fresh process, and reports for each case the median and fastest CPU
+time of the search, the states expanded and generated, the states expanded per second, the
+cost of the solution and the memory high-water mark of the search. The results can be saved
+as a baseline and later runs compared against it: a case regresses when it becomes slower,
+expands more states or uses more memory than the baseline by more than a tolerance, or finds
+a more expensive solution (or none). A case whose run fails (raises, is killed or does not report
+within its timebound plus --slack seconds) is reported as failed, counts as a regression when
+comparing against a baseline and makes the exit status 1. Run it before and after touching a hot path in search.py.
+
+Usage:
+  python benchmark.py                                 (run all cases and print the results)
+  python benchmark.py --save-baseline baseline.json   (... and store them as the baseline)
+  python benchmark.py --baseline baseline.json        (... and compare, exit status 1 on a regression)
+  python benchmark.py --cases astar --repeat 5        (only the cases whose name contains 'astar')
+  python benchmark.py --time-tolerance 0.1 --node-tolerance 0 --memory-tolerance 0.25
+
+The baseline file is a JSON object mapping case names (strategy/heuristic/level) to their results.
+The memory high-water mark is the growth of the process's peak resident set size during the
+search (from getrusage, so it is not available on Windows).
+"""
+
+import argparse
+import json
+import multiprocessing
+import queue
+import statistics
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+import solution
+from search import SearchEngine
+from sokoban import PROBLEMS, sokoban_goal_state
+
+# (strategy, heuristic of solution.py, PROBLEMS index); each takes at most a few seconds
+MATRIX = [
+    ('astar', 'heur_alternate', 2),
+    ('astar', 'heur_alternate', 6),
+    ('astar', 'heur_alternate', 7),
+    ('astar', 'heur_alternate', 21),
+    ('astar', 'heur_push_distance', 2),
+    ('astar', 'heur_push_distance', 3),
+    ('astar', 'heur_push_distance', 4),
+    ('astar', 'heur_push_distance', 20),
+    ('best_first', 'heur_alternate', 15),
+    ('best_first', 'heur_alternate', 17),
+    ('best_first', 'heur_alternate', 19),
+    ('idastar', 'heur_push_distance', 4),
+    ('idastar', 'heur_push_distance', 20),
+    ('idastar', 'heur_push_distance', 21),
+    ('ucs', 'heur_zero', 2),
+    ('ucs', 'heur_zero', 20),
+]
+
+
+#######################################
+# UTILITIES
+#######################################
+def case_name(case):
+    return '%s/%s/%d' % case
+
+
+def run_case(case, timebound):
+    """Search once for the given case and return the measurements of the search."""
+    strategy, heuristic, level = case
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    se = SearchEngine(strategy)
+    se.init_search(PROBLEMS[level], sokoban_goal_state, getattr(solution, heuristic))
+    start = time.process_time()
+    final, stats = se.search(timebound)
+    elapsed = time.process_time() - start
+    # ru_maxrss is in kilobytes on Linux
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_before if resource else None
+    return dict(time=elapsed, expanded=stats.states_expanded, generated=stats.states_generated,
+                cost=final.gval if final else None, memory_kb=memory)
+
+
+def _worker(case, timebound, results):
+    results.put(run_case(case, timebound))
+
+
+def collect(process, results, deadline):
+    """Return the result of a run's process, or the reason it has none (it ended without one or overran the deadline)."""
+    while True:
+        try:
+            return results.get(timeout=0.1), None
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            try:
+                # (it may have reported just before it ended)
+                return results.get(timeout=0.1), None
+            except queue.Empty:
+                return None, 'exited with code %s' % process.exitcode
+        if time.monotonic() > deadline:
+            process.terminate()
+            return None, 'did not finish in time'
+
+
+def measure(case, repeat, timebound, slack):
+    """
+    Run a case repeat times, each in a new process, and summarize the runs. If a run fails, return
+    dict(failed=reason) instead.
+    """
+    runs = []
+    for _ in range(repeat):
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_worker, args=(case, timebound, results))
+        process.start()
+        run, failure = collect(process, results, time.monotonic() + timebound + slack)
+        process.join()
+        if failure:
+            return dict(failed=failure)
+        runs.append(run)
+    times = [run['time'] for run in runs]
+    first = runs[0]
+    median = statistics.median(times)
+    return dict(time=median, min_time=min(times),
+                expanded=first['expanded'], generated=first['generated'],
+                nodes_per_second=first['expanded'] / median if median else None,
+                cost=first['cost'], memory_kb=max(run['memory_kb'] for run in runs) if resource else None,
+                # the search is deterministic, so the counts should not differ between runs
+                deterministic=all((run['expanded'], run['cost']) == (first['expanded'], first['cost'])
+                                  for run in runs))
+
+
+def regressions(result, base, args):
+    """Return the descriptions of the ways in which result is worse than the baseline result base."""
+    found = []
+    if base['cost'] is not None and (result['cost'] is None or result['cost'] > base['cost']):
+        found.append('cost %s -> %s' % (base['cost'], result['cost']))
+    if result['time'] > base['time'] * (1 + args.time_tolerance) + args.time_slack:
+        found.append('time %.3fs -> %.3fs' % (base['time'], result['time']))
+    if result['expanded'] > base['expanded'] * (1 + args.node_tolerance):
+        found.append('expanded %d -> %d' % (base['expanded'], result['expanded']))
+    if (result['memory_kb'] is not None and base.get('memory_kb') is not None and
+            result['memory_kb'] > base['memory_kb'] * (1 + args.memory_tolerance) + args.memory_slack):
+        found.append('memory %dkB -> %dkB' % (base['memory_kb'], result['memory_kb']))
+    return found
+
+
+#######################################
+# MAIN FUNCTION
+#######################################
+def main():
+    parser = argparse.ArgumentParser(description="Run the Sokoban search engine benchmarks.")
+    parser.add_argument("--cases", "-k", nargs="+",
+                        help="Only run the cases whose name (strategy/heuristic/level) contains one of these")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="Runs of each case (default: 3)")
+    parser.add_argument("--timebound", "-t", type=float, default=60,
+                        help="Seconds each search may take (default: 60)")
+    parser.add_argument("--slack", type=float, default=30,
+                        help="Seconds a run may take beyond the timebound before it counts as failed (default: 30)")
+    parser.add_argument("--baseline", "-b", help="Compare against this baseline file")
+    parser.add_argument("--save-baseline", "-s", help="Save the results to this baseline file")
+    parser.add_argument("--time-tolerance", type=float, default=0.2,
+                        help="Allowed relative increase of the median time (default: 0.2)")
+    parser.add_argument("--time-slack", type=float, default=0.01,
+                        help="Allowed absolute increase of the median time in seconds (default: 0.01)")
+    parser.add_argument("--node-tolerance", type=float, default=0.0,
+                        help="Allowed relative increase of the states expanded (default: 0)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2,
+                        help="Allowed relative increase of the memory high-water mark (default: 0.2)")
+    parser.add_argument("--memory-slack", type=int, default=1024,
+                        help="Allowed absolute increase of the memory high-water mark in kB (default: 1024)")
+    args = parser.parse_args()
+
+    cases = [case for case in MATRIX
+             if not args.cases or any(pattern in case_name(case) for pattern in args.cases)]
+    if not cases:
+        print("No matching cases found. Exiting.")
+        return
+    baseline = dict()
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    print("%-36s %9s %9s %9s %9s %11s %5s %9s" % ('case', 'median s', 'min s', 'expanded', 'generated',
+                                                   'nodes/s', 'cost', 'memory kB'))
+    results = dict()
+    failed = 0
+    for case in cases:
+        name = case_name(case)
+        result = measure(case, args.repeat, args.timebound, args.slack)
+        if 'failed' in result:
+            # not saved, so a baseline never holds a failed case
+            print("%-36s [FAILED] %s" % (name, result['failed']))
+            failed += 1
+            sys.stdout.flush()
+            continue
+        results[name] = result
+        print("%-36s %9.3f %9.3f %9d %9d %11.0f %5s %9s" % (
+            name, result['time'], result['min_time'], result['expanded'], result['generated'],
+            result['nodes_per_second'] or 0, result['cost'], result['memory_kb']))
+        if not result['deterministic']:
+            print("    [WARNING] the runs expanded different numbers of states")
+        if name in baseline:
+            found = regressions(result, baseline[name], args)
+            if found:
+                failed += 1
+                print("    [REGRESSION] " + ", ".join(found))
+        elif args.baseline:
+            print("    [NEW] not in the baseline")
+        sys.stdout.flush()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        print("Regressions: %d/%d" % (failed, len(cases)))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+'''Sokoban level collections.
+    Reads levels from text files in the standard XSB format, as used by most Sokoban level
+    collections, into SokobanState objects:
+
+        #  wall                     $  box
+        .  storage point            *  box on a storage point
+        @  robot                    +  robot on a storage point
+        space, - or _  floor
+
+    Multiple robots are allowed. A collection may also name its robots with the letters
+    state_string uses (a, b, ... for robot 0, 1, ... and A, B, ... for the same robots on a
+    storage point), so printed states can be read back; robots given as @ or + are numbered
+    after the lettered ones, in reading order.
+
+    A level is a run of consecutive lines that only contain these characters and contain a
+    wall. All other lines (blank lines, ; comments, Title: and other metadata) separate levels.
+
+    A) Function parse_level
+    Turns the lines of one level into a SokobanState.
+    B) Function iter_levels
+    A generator that reads a collection file one level at a time.
+    C) Class LevelCollection
+    Random access to the levels of a collection file through an index file of byte offsets.
+    D) Functions generate_level and generate_levels
+    A seeded generator of solvable levels of any size, by playing backwards from a goal configuration.
+
+    Run as a script to write a collection of generated levels, e.g.
+        python levels.py --count 100 --width 20 --height 20 --boxes 8 --robots 2 --seed 1 > large.xsb
+'''
+
+import argparse
+import os
+import random
+import struct
+import sys
+from collections import deque
+
+from sokoban import SokobanState, UP, RIGHT, DOWN, LEFT
+
+_WALL = '#'
+_FLOOR = ' -_'
+_BOARD_CHARACTERS = frozenset('#.$*@+ -_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+def is_board_line(line):
+    '''@return: True if line (without its line break) is a row of a level.'''
+    return _WALL in line and _BOARD_CHARACTERS.issuperset(line)
+
+
+def parse_level(lines):
+    '''
+    Build the initial state of a level.
+    Floor outside the level's walls is made an obstacle, and rows and columns at the edges that are
+    all obstacles are dropped, since SokobanState already surrounds the room with walls.
+    @param lines: The rows of the level, without line breaks.
+    @return: A SokobanState with action "START" and gval 0.
+    '''
+    width = max(len(line) for line in lines)
+    rows = [line.ljust(width) for line in lines]
+    height = len(rows)
+
+    walls, storage, boxes, lettered, robots = set(), set(), set(), dict(), []
+    for y, row in enumerate(rows):
+        for x, c in enumerate(row):
+            if c == _WALL:
+                walls.add((x, y))
+            elif c in _FLOOR:
+                continue
+            elif c in '.*+':
+                storage.add((x, y))
+            elif c.isupper():
+                storage.add((x, y))
+            if c in '$*':
+                boxes.add((x, y))
+            elif c in '@+':
+                robots.append((x, y))
+            elif c.isalpha():
+                robot = ord(c.lower()) - ord('a')
+                if robot in lettered:
+                    raise ValueError("robot {} appears twice".format(c))
+                lettered[robot] = (x, y)
+    if sorted(lettered) != list(range(len(lettered))):
+        raise ValueError("robot letters must be consecutive from a")
+    robots = [lettered[robot] for robot in range(len(lettered))] + robots
+    if not robots:
+        raise ValueError("level has no robot")
+    if len(boxes) > len(storage):
+        raise ValueError("level has more boxes than storage points")
+
+    # flood the empty floor reachable from the edges without crossing a wall: it is outside the level
+    occupied = walls | storage | boxes | set(robots)
+    outside = set()
+    frontier = deque((x, y) for x in range(width) for y in range(height)
+                     if (x in (0, width - 1) or y in (0, height - 1)) and (x, y) not in occupied)
+    outside.update(frontier)
+    while frontier:
+        x, y = frontier.popleft()
+        for location in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if (0 <= location[0] < width and 0 <= location[1] < height and
+                    location not in occupied and location not in outside):
+                outside.add(location)
+                frontier.append(location)
+    obstacles = walls | outside
+
+    # drop edge rows and columns of obstacles
+    left, top, right, bottom = 0, 0, width, height
+    while left < right and all((left, y) in obstacles for y in range(top, bottom)):
+        left += 1
+    while right > left and all((right - 1, y) in obstacles for y in range(top, bottom)):
+        right -= 1
+    while top < bottom and all((x, top) in obstacles for x in range(left, right)):
+        top += 1
+    while bottom > top and all((x, bottom - 1) in obstacles for x in range(left, right)):
+        bottom -= 1
+
+    def shift(locations):
+        return frozenset((x - left, y - top) for x, y in locations
+                         if left <= x < right and top <= y < bottom)
+
+    return SokobanState("START", 0, None, right - left, bottom - top,
+                        tuple((x - left, y - top) for x, y in robots),
+                        shift(boxes), shift(storage), shift(obstacles))
+
+
+def _read_levels(file):
+    '''
+    @param file: A collection file opened in binary mode.
+    @return: A generator of (byte offset, rows) pairs, one for each level from the file's current position on.
+    '''
+    offset = file.tell()
+    start, rows = None, []
+    for line in file:
+        text = line.decode('utf-8', 'replace').rstrip('\r\n')
+        if is_board_line(text):
+            if not rows:
+                start = offset
+            rows.append(text)
+        elif rows:
+            yield start, rows
+            rows = []
+        offset += len(line)
+    if rows:
+        yield start, rows
+
+
+def iter_levels(path):
+    '''
+    Read a collection one level at a time; a level is only parsed when the generator gets to it.
+    @param path: The path of the collection file.
+    @return: A generator of the initial SokobanStates of the levels, in the order of the file.
+    '''
+    with open(path, 'rb') as file:
+        for _, rows in _read_levels(file):
+            yield parse_level(rows)
+
+
+class LevelCollection:
+    '''
+    A collection file with random access to its levels: collection[i] reads and parses only level i.
+    The byte offsets of the levels are kept in an index file (by default the collection's path with
+    .idx appended), built with one pass over the collection the first time it is needed and rebuilt
+    whenever the collection's size or modification time no longer match the ones it records.
+
+    The index file is a header of two unsigned 64-bit integers (the collection's size and modification
+    time in nanoseconds) followed by one unsigned 64-bit offset per level, all little endian, so finding
+    a level's offset is a single seek into the index as well.
+    '''
+    _HEADER = struct.Struct('<QQ')
+    _OFFSET = struct.Struct('<Q')
+
+    def __init__(self, path, index_path=None):
+        '''
+        @param path: The path of the collection file.
+        @param index_path: The path of its index file.
+        '''
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        stat = os.stat(path)
+        header = self._HEADER.pack(stat.st_size, stat.st_mtime_ns)
+        try:
+            with open(self.index_path, 'rb') as index:
+                current = index.read(self._HEADER.size) == header
+                size = os.fstat(index.fileno()).st_size
+        except OSError:
+            current = False
+        if not current:
+            size = self._build_index(header)
+        self.levels = (size - self._HEADER.size) // self._OFFSET.size
+
+    def _build_index(self, header):
+        '''Write the index file. @return: its size in bytes.'''
+        with open(self.path, 'rb') as file, open(self.index_path, 'wb') as index:
+            index.write(header)
+            for offset, _ in _read_levels(file):
+                index.write(self._OFFSET.pack(offset))
+            return index.tell()
+
+    def __len__(self):
+        return self.levels
+
+    def __getitem__(self, i):
+        '''@return: The initial SokobanState of level i (counting from 0).'''
+        if i < 0:
+            i += self.levels
+        if not 0 <= i < self.levels:
+            raise IndexError("level index out of range")
+        with open(self.index_path, 'rb') as index:
+            index.seek(self._HEADER.size + i * self._OFFSET.size)
+            offset, = self._OFFSET.unpack(index.read(self._OFFSET.size))
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            _, rows = next(_read_levels(file))
+        return parse_level(rows)
+
+    def __iter__(self):
+        return iter_levels(self.path)
+
+
+def _connected(floor):
+    '''@return: True if every location in the set floor can be reached from every other one.'''
+    start = next(iter(floor))
+    reached = {start}
+    frontier = [start]
+    while frontier:
+        x, y = frontier.pop()
+        for location in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if location in floor and location not in reached:
+                reached.add(location)
+                frontier.append(location)
+    return len(reached) == len(floor)
+
+
+def generate_level(width, height, boxes, robots=1, seed=None, obstacle_density=0.15, moves=None,
+                   pull_probability=0.5, attempts=10):
+    '''
+    Generate a solvable level by reverse play: obstacles are scattered at random (keeping the floor
+    connected), the boxes are put on random storage points with the robots at random floor locations,
+    and the robots then make random moves backwards in time. A robot moving away from a box
+    behind it may pull the box along, the reverse of a push, so every position reached can be played
+    forward to the goal configuration. Of the positions reached, the one whose boxes are furthest
+    (by Manhattan distance) from the storage points is returned.
+
+    @param width: The room's X dimension (excluding walls).
+    @param height: The room's Y dimension (excluding walls).
+    @param boxes: The number of boxes (and of storage points).
+    @param robots: The number of robots.
+    @param seed: The seed of the random number generator; the same arguments and seed give the same level.
+    @param obstacle_density: The fraction of the room to try to fill with obstacles.
+    @param moves: The number of backward moves to try (default: 20 * (width + height) * boxes).
+    @param pull_probability: The chance that a robot moving away from a box pulls it.
+    @param attempts: How many times to play backwards before giving up on moving any box off storage.
+    @return: A SokobanState with action "START" and gval 0.
+    '''
+    if boxes < 1 or robots < 1:
+        raise ValueError("a level needs at least one box and one robot")
+    if boxes + robots > width * height:
+        raise ValueError("the room is too small for {} boxes and {} robots".format(boxes, robots))
+    rng = random.Random(seed)
+    if moves is None:
+        moves = 20 * (width + height) * boxes
+
+    floor = {(x, y) for x in range(width) for y in range(height)}
+    for _ in range(int(obstacle_density * width * height)):
+        location = rng.choice(sorted(floor))
+        floor.discard(location)
+        if len(floor) < boxes + robots + 1 or not _connected(floor):
+            floor.add(location)
+    obstacles = frozenset((x, y) for x in range(width) for y in range(height)) - floor
+
+    locations = sorted(floor)
+    storage = frozenset(rng.sample(locations, boxes))
+    directions = [UP, RIGHT, DOWN, LEFT]
+
+    def distance(box_locations):
+        return sum(min(abs(x - sx) + abs(y - sy) for sx, sy in storage) for x, y in box_locations)
+
+    for _ in range(attempts):
+        box_locations = set(storage)
+        robot_locations = rng.sample([location for location in locations if location not in storage], robots)
+        best, best_distance = None, 0
+        for _ in range(moves):
+            robot = rng.randrange(robots)
+            location = robot_locations[robot]
+            direction = rng.choice(directions)
+            destination = direction.move(location)
+            if destination not in floor or destination in box_locations or destination in robot_locations:
+                continue
+            behind = (2 * location[0] - destination[0], 2 * location[1] - destination[1])
+            if behind in box_locations and rng.random() < pull_probability:
+                box_locations.remove(behind)
+                box_locations.add(location)
+            robot_locations[robot] = destination
+            if not box_locations <= storage:
+                box_distance = distance(box_locations)
+                if box_distance > best_distance:
+                    best, best_distance = (tuple(robot_locations), frozenset(box_locations)), box_distance
+        if best is not None:
+            return SokobanState("START", 0, None, width, height, best[0], best[1], storage, obstacles)
+    raise ValueError("no box could be moved off storage, try fewer obstacles or more moves")
+
+
+def generate_levels(count, width, height, boxes, robots=1, seed=0, **options):
+    '''
+    @return: A generator of count levels made by generate_level; level i uses seed seed + i, so any one
+    of them can be generated again on its own.
+    '''
+    for i in range(count):
+        yield generate_level(width, height, boxes, robots, seed + i, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a collection of generated Sokoban levels.")
+    parser.add_argument("--count", "-n", type=int, default=1, help="The number of levels (default: 1)")
+    parser.add_argument("--width", type=int, default=20, help="The width of the rooms (default: 20)")
+    parser.add_argument("--height", type=int, default=20, help="The height of the rooms (default: 20)")
+    parser.add_argument("--boxes", type=int, default=6, help="The number of boxes (default: 6)")
+    parser.add_argument("--robots", type=int, default=1, help="The number of robots (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the first level (default: 0)")
+    parser.add_argument("--obstacle-density", type=float, default=0.15,
+                        help="The fraction of the rooms to fill with obstacles (default: 0.15)")
+    parser.add_argument("--moves", type=int, help="The number of backward moves (default: 20 * (width + height) * boxes)")
+    args = parser.parse_args()
+
+    try:
+        for i, state in enumerate(generate_levels(args.count, args.width, args.height, args.boxes, args.robots,
+                                                  args.seed, obstacle_density=args.obstacle_density,
+                                                  moves=args.moves)):
+            sys.stdout.write("; seed {}\n{}\n".format(args.seed + i, state.state_string().rstrip('\n')))
+    except ValueError as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    main()
@@ -37,13 +37,31 @@
       a goal is found (using searchOpen). See the implementation for details.
 
     '''
+from array import array
+from bisect import bisect_left
 import heapq
-from collections import deque
+from collections import deque, OrderedDict
+from itertools import chain, groupby
+import json
+import math
+import multiprocessing
+from operator import itemgetter
 import os
+import pickle
+import queue
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
 
 
 class StateSpace:
     '''Abstract class for defining State spaces for search routines'''
+    __slots__ = ('action', 'gval', 'parent', 'index')
     n = 0
 
     def __init__(self, action, gval, parent):
@@ -125,6 +143,11 @@ _BEST_FIRST = 2
 _ASTAR = 3
 _UCS = 4
 _CUSTOM = 5
+_IDASTAR = 6
+_ARASTAR = 7
+_HDASTAR = 8
+_SMASTAR = 9
+_EXTERNAL = 10
 
 # For best first and astar we use a priority queue. This requires
 # a comparison function for nodes. These constants indicate if we use
@@ -141,6 +164,13 @@ _CC_NONE = 0
 _CC_PATH = 1
 _CC_FULL = 2
 
+# OPEN backends for the priority queue strategies. Either OPEN_HEAP 'heap'
+# (binary heap) or OPEN_BUCKET 'bucket' (two-level bucket queue, used while
+# all priorities are integers and replaced by a heap as soon as a non-integer
+# priority such as a weighted fval is inserted). 'default' uses buckets.
+_OPEN_HEAP = 0
+_OPEN_BUCKET = 1
+
 
 # Zero Heuristic Function---for uninformed search don't include heur_fn
 # in call to search engine's search method, defaults heur_fn to the zero fn.
@@ -154,17 +184,144 @@ def _fval_function(state):
     return state.hval
 
 
+class IncrementalHeuristic:
+    '''Abstract class for heuristics that can update a parent's evaluation
+       instead of evaluating every state from scratch. A successor usually
+       differs from its parent in very little (e.g., one box moved), so when
+       the heur_fn given to the search engine is an IncrementalHeuristic the
+       engine keeps the "info" (the breakdown of the hval, e.g., per-box
+       distances or the current matching) that evaluate returned for each
+       node, and hands the expanded node's state and info to evaluate for
+       each of its successors. The info of a node is shared by all of its
+       successors, so it must never be modified once returned.
+
+       An IncrementalHeuristic can also be called like an ordinary heuristic
+       function, which evaluates the state from scratch.'''
+
+    def evaluate(self, state, parent, parent_info):
+        '''Return a pair (hval, info) for state. parent is the state state
+           was generated from and parent_info the info returned for it, or
+           both are None if the state must be evaluated from scratch.'''
+        raise Exception("Must be overridden in subclass.")
+
+    def __call__(self, state):
+        return self.evaluate(state, None, None)[0]
+
+
 class SearchStats:
 
-    def __init__(self, n1, n2, n3, n4, n5):
+    def __init__(self, n1, n2, n3, n4, n5, n6=0, n7=0, iterations=None):
         self.states_expanded = n1
         self.states_generated = n2
         self.states_pruned_cycles = n3
         self.states_pruned_cost = n4
         self.total_time = n5
+        self.heur_cache_hits = n6
+        self.heur_cache_misses = n7
+        # for idastar, a list with one (f-value threshold, states expanded, states generated)
+        # triple for each iteration
+        self.iterations = iterations
+        self.nodes_per_second = n1 / n5 if n5 else None
+        # for smastar, the number of nodes dropped to stay within the memory limit
+        self.states_forgotten = 0
+        # for external_astar, the number of bytes written to the sorted runs on disk
+        self.bytes_spilled = 0
+        # the limit of the SearchBudget that stopped the search (see SearchBudget.limit_reached)
+        self.limit_reached = None
+        # when profiling (see SearchEngine.profile_on), the seconds spent in each phase of the
+        # search and the peak sizes of OPEN and the cycle check dictionary
+        self.profile = None
+
+    def to_json(self):
+        '''Return the statistics as a JSON object (string)'''
+        return json.dumps(vars(self))
 
     def __str__(self):
-        return f'states generated: {self.states_generated}\nstates explored: {self.states_expanded}\nstate pruned by cycle checking: {self.states_pruned_cycles}\nstates pruned by cost checking: {self.states_pruned_cost}\ntotal search time: {self.total_time}\n'
+        s = f'states generated: {self.states_generated}\nstates explored: {self.states_expanded}\nstate pruned by cycle checking: {self.states_pruned_cycles}\nstates pruned by cost checking: {self.states_pruned_cost}\ntotal search time: {self.total_time}\n'
+        if self.heur_cache_hits or self.heur_cache_misses:
+            s += f'heuristic cache hits: {self.heur_cache_hits}\nheuristic cache misses: {self.heur_cache_misses}\n'
+        if self.states_forgotten:
+            s += f'states forgotten: {self.states_forgotten}\n'
+        if self.bytes_spilled:
+            s += f'bytes spilled to disk: {self.bytes_spilled}\n'
+        if self.limit_reached:
+            s += f'limit reached: {self.limit_reached}\n'
+        if self.iterations:
+            for threshold, expanded, generated in self.iterations:
+                s += f'iteration with f <= {threshold}: {expanded} states explored, {generated} states generated\n'
+        if self.profile:
+            s += f'nodes per second: {self.nodes_per_second}\n'
+            for name, value in self.profile.items():
+                s += f'{name.replace("_", " ")}: {value}\n'
+        return s
+
+
+class HeuristicCache:
+    '''A bounded memo of heuristic evaluations keyed on hashable_state().
+       With full cycle checking the same state is often regenerated (and
+       tracing evaluates the heuristic again), so the search engine can
+       look its hval up here instead of recomputing it. When more than size
+       states are cached the least recently used one is evicted. Hits and
+       misses are counted for SearchStats.
+
+       Each entry is the pair (hval, hinfo), hinfo being the info returned
+       by an IncrementalHeuristic (None for ordinary heuristic functions).
+       The cache can also be called like a heuristic function.'''
+
+    def __init__(self, heur_fn, size):
+        self.heur_fn = heur_fn
+        self.size = size
+        self.incremental = isinstance(heur_fn, IncrementalHeuristic)
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def evaluate(self, key, state, parent=None, parent_info=None):
+        '''Return the (hval, hinfo) pair of state, whose hashable_state() is key'''
+        entry = self.table.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.table.move_to_end(key)
+            return entry
+        self.misses += 1
+        if self.incremental:
+            entry = self.heur_fn.evaluate(state, parent, parent_info)
+        else:
+            entry = (self.heur_fn(state), None)
+        self.table[key] = entry
+        if len(self.table) > self.size:
+            self.table.popitem(last=False)
+        return entry
+
+    def __call__(self, state):
+        return self.evaluate(state.hashable_state(), state)[0]
+
+
+class _Heuristic:
+    '''A heuristic function, IncrementalHeuristic or HeuristicCache behind the one interface the
+       search loops use: evaluate(key, state, parent, parent_info) returns the pair (hval, hinfo)
+       of state, key being its hashable_state() (only the cache looks at it) and hinfo None
+       unless the heuristic is incremental. Set up once by init_search.'''
+
+    def __init__(self, heur_fn):
+        self.heur_fn = heur_fn
+        if isinstance(heur_fn, HeuristicCache):
+            self.evaluate = heur_fn.evaluate
+        elif isinstance(heur_fn, IncrementalHeuristic):
+            self.evaluate = self._evaluate_incremental
+        else:
+            self.evaluate = self._evaluate_plain
+
+    def _evaluate_incremental(self, key, state, parent, parent_info):
+        return self.heur_fn.evaluate(state, parent, parent_info)
+
+    def _evaluate_plain(self, key, state, parent, parent_info):
+        return self.heur_fn(state), None
+
+
+def _over_bound(costbound, gval, hval):
+    '''Return whether the cost bound 3-tuple (None for no bound) rules out a node with these g and h-values.'''
+    return costbound is not None and (gval > costbound[0] or hval > costbound[1] or gval + hval > costbound[2])
 
 
 class sNode:
@@ -177,9 +334,10 @@ class sNode:
     n = 0
     lt_type = _SUM_HG
 
-    def __init__(self, state, hval, fval_function):
+    def __init__(self, state, hval, fval_function, hinfo=None):
         self.state = state
         self.hval = hval
+        self.hinfo = hinfo
         self.gval = state.gval
         self.index = sNode.n
         self.fval_function = fval_function
@@ -216,101 +374,609 @@ class sNode:
         return self.gval < other.gval
 
 
+class BucketQueue:
+    '''A two-level bucket priority queue for integer priorities. Nodes
+       are filed under their priority and then under a tie-break value
+       (e.g., fval then -gval for astar); within a bucket nodes come out
+       first in first out. Insertion is O(1) and extraction is O(1)
+       amortized: the minimum keys are cached and only recomputed (over
+       the handful of distinct keys present) when a bucket empties. This
+       gives the same extraction order as a heap of (priority, tie-break,
+       node index) tuples.'''
+
+    def __init__(self):
+        self.buckets = dict()  # priority -> {tie-break -> deque of nodes}
+        self.min_priority = None
+        self.min_tie = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for level in self.buckets.values():
+            for bucket in level.values():
+                yield from bucket
+
+    def remove(self, drop):
+        '''Remove the nodes for which drop(node) is true, in one pass, and return them in a list'''
+        removed = []
+        for priority in list(self.buckets):
+            level = self.buckets[priority]
+            for tie in list(level):
+                bucket = level[tie]
+                kept = deque()
+                for node in bucket:
+                    if drop(node):
+                        removed.append(node)
+                    else:
+                        kept.append(node)
+                if kept:
+                    level[tie] = kept
+                else:
+                    del level[tie]
+            if not level:
+                del self.buckets[priority]
+        self.size -= len(removed)
+        if self.buckets:
+            self.min_priority = min(self.buckets)
+            self.min_tie = min(self.buckets[self.min_priority])
+        else:
+            self.min_priority = self.min_tie = None
+        return removed
+
+    def push(self, priority, tie, node):
+        level = self.buckets.get(priority)
+        if level is None:
+            level = self.buckets[priority] = dict()
+        bucket = level.get(tie)
+        if bucket is None:
+            bucket = level[tie] = deque()
+        bucket.append(node)
+        self.size += 1
+        if self.min_priority is None or priority < self.min_priority:
+            self.min_priority = priority
+            self.min_tie = tie
+        elif priority == self.min_priority and tie < self.min_tie:
+            self.min_tie = tie
+
+    def pop(self):
+        level = self.buckets[self.min_priority]
+        bucket = level[self.min_tie]
+        node = bucket.popleft()
+        self.size -= 1
+        if not bucket:
+            del level[self.min_tie]
+            if not level:
+                del self.buckets[self.min_priority]
+                if not self.buckets:
+                    self.min_priority = self.min_tie = None
+                    return node
+                self.min_priority = min(self.buckets)
+                level = self.buckets[self.min_priority]
+            self.min_tie = min(level)
+        return node
+
+
 class Open:
     '''Open objects hold the search frontier---the set of unexpanded
        nodes. Depending on the search strategy used we want to extract
        nodes from this set in different orders, so set up the object's
        functions to operate as needed by the particular search
-       strategy'''
+       strategy.
+
+       For the priority queue strategies each node is stored in the
+       heap as a tuple (priority, tie-break, node index, node). The
+       priority is computed once when the node is inserted, so heap
+       operations compare plain numbers and never have to call back
+       into sNode.__lt__ (or the fval_function). The node index is
+       unique, so comparison never reaches the node itself.
 
-    def __init__(self, search_strategy):
+       With the bucket backend the same (priority, tie-break) key files
+       the node in a BucketQueue instead. The first time a key that is
+       not an integer shows up, the queue is converted to a heap.'''
+
+    def __init__(self, search_strategy, open_type=_OPEN_HEAP):
         if search_strategy == _DEPTH_FIRST:
             # use stack for OPEN set (last in---most recent successor added---is first out)
             self.open = []
             self.insert = self.open.append
             self.extract = self.open.pop
+            return
         elif search_strategy == _BREADTH_FIRST:
             # use queue for OPEN (first in---earliest node not yet expanded---is first out)
             self.open = deque()
             self.insert = self.open.append
             self.extract = self.open.popleft
+            return
         elif search_strategy == _UCS:
             # use priority queue for OPEN (first out is node with lowest gval)
-            self.open = []
             # set node less than function to compare gvals only
             sNode.lt_type = _G
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.key = lambda node: (node.gval, 0)
         elif search_strategy == _BEST_FIRST:
             # use priority queue for OPEN (first out is node with lowest hval)
-            self.open = []
             # set node less than function to compare hvals only
             sNode.lt_type = _H
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.key = lambda node: (node.hval, 0)
         elif search_strategy == _ASTAR:
             # use priority queue for OPEN (first out is node with lowest fval = gval+hval)
-            self.open = []
             # set node less than function to compare sums of hval and gval
             sNode.lt_type = _SUM_HG
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            # break ties on fval by greatest gval (see sNode.__lt__)
+            self.key = lambda node: (node.gval + node.hval, -node.gval)
         elif search_strategy == _CUSTOM:
             # use priority queue for OPEN (first out is node with lowest fval)
-            self.open = []
             # set node less than function to compare sums of fval
             sNode.lt_type = _C
-            self.insert = lambda node: heapq.heappush(self.open, node)
-            self.extract = lambda: heapq.heappop(self.open)
+            self.key = lambda node: (node.fval_function(node), 0)
+
+        if open_type == _OPEN_BUCKET:
+            self.open = BucketQueue()
+            self.insert = self._bucket_insert
+            self.extract = self.open.pop
+        else:
+            self.open = []
+            self._use_heap()
+
+    def _use_heap(self):
+        key = self.key
+        self.insert = lambda node: heapq.heappush(self.open, (*key(node), node.index, node))
+        self.extract = lambda: heapq.heappop(self.open)[-1]
+
+    def _bucket_insert(self, node):
+        priority, tie = self.key(node)
+        if type(priority) is int and type(tie) is int:
+            self.open.push(priority, tie, node)
+            return
+        # non-integer priority (e.g., a weighted fval or infinity): move to a heap
+        heap = [(*self.key(nd), nd.index, nd) for nd in self.open]
+        heapq.heapify(heap)
+        self.open = heap
+        self._use_heap()
+        self.insert(node)
 
     def empty(self):
         return not self.open
 
+    def nodes(self):
+        '''Return the search nodes currently on OPEN (in no particular order)'''
+        if self.open and isinstance(self.open, list) and isinstance(self.open[0], tuple):
+            return [entry[-1] for entry in self.open]
+        return list(self.open)
+
+    def remove(self, drop):
+        '''Remove the nodes for which drop(node) is true from OPEN in one
+           pass, restoring the heap (or bucket) order once afterwards
+           rather than after each removal. Returns the removed nodes.'''
+        if isinstance(self.open, BucketQueue):
+            return self.open.remove(drop)
+        if self.open and isinstance(self.open, list) and isinstance(self.open[0], tuple):
+            removed = [entry[-1] for entry in self.open if drop(entry[-1])]
+            if removed:
+                self.open[:] = [entry for entry in self.open if not drop(entry[-1])]
+                heapq.heapify(self.open)
+            return removed
+        removed = [node for node in self.open if drop(node)]
+        if removed:
+            kept = [node for node in self.open if not drop(node)]
+            self.open.clear()
+            self.open.extend(kept)
+        return removed
+
     def print_open(self):
         print("{", end="")
-        if len(self.open) == 1:
-            print("   <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(self.open[0].state.index, self.open[0].state.action,
-                                                                self.open[0].state.hashable_state(), self.open[0].gval,
-                                                                self.open[0].hval,
-                                                                self.open[0].gval + self.open[0].hval), end="")
-        else:
-            for nd in self.open:
-                print("   <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(nd.state.index, nd.state.action,
-                                                                    nd.state.hashable_state(), nd.gval, nd.hval,
-                                                                    nd.gval + nd.hval), end="")
+        for nd in self.nodes():
+            print("   <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(nd.state.index, nd.state.action,
+                                                                nd.state.hashable_state(), nd.gval, nd.hval,
+                                                                nd.gval + nd.hval), end="")
         print("}")
 
 
+def _parse_bytes(size):
+    '''Return the number of bytes in a string such as '512MB', '2GB', '64KB' or '1000000'.'''
+    units = {'KB': 2 ** 10, 'MB': 2 ** 20, 'GB': 2 ** 30}
+    size = size.strip().upper()
+    if size[-2:] in units:
+        return int(float(size[:-2]) * units[size[-2:]])
+    return int(size.rstrip('B'))
+
+
+def _estimated_node_size(node):
+    '''
+    Estimate the bytes a node of the smastar search tree takes: the node, its state, the state's
+    hashable_state() (walking into tuples and frozensets, which hold the state's own data) and its
+    two OPEN entries. Objects shared by all states (e.g., a Sokoban Level) are not counted.
+    '''
+    size = sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.state) + 2 * sys.getsizeof((0,) * 5)
+    pending = [node.state.hashable_state()]
+    while pending:
+        item = pending.pop()
+        size += sys.getsizeof(item)
+        if isinstance(item, (tuple, frozenset)):
+            pending.extend(item)
+    return size
+
+
+def _resident_memory():
+    '''Return the resident set size of this process in bytes, or None where it can't be measured.'''
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # the high-water mark instead, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+class SearchBudget:
+    '''
+    The limits on a search: user CPU time (what timebound has always measured), wall clock time,
+    search nodes created (states_expanded in SearchStats) and resident memory of the process.
+    Pass it to SearchEngine.search. The limits hold for all the searches a budget is passed to
+    together, counted from the first of them (or from start), so an anytime loop can pass the
+    same budget to each of its searches.
+
+    Reading the clocks on every expansion costs about as much as a cheap expansion, so the
+    limits are only checked every interval expansions. The interval adapts to the speed of the
+    search so that checks are about check_period seconds apart, and is kept short enough not to
+    overrun the time and node limits by more than that.
+    '''
+
+    def __init__(self, cpu_time=None, wall_time=None, nodes=None, memory=None, check_period=0.005):
+        '''
+        @param cpu_time: seconds of user CPU time.
+        @param wall_time: seconds of elapsed (wall clock) time.
+        @param nodes: the number of search nodes.
+        @param memory: the resident memory of the process in bytes, or a string such as '2GB'.
+        @param check_period: the seconds between two checks the interval aims for.
+        '''
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+        self.nodes = nodes
+        self.memory = _parse_bytes(memory) if isinstance(memory, str) else memory
+        self.check_period = check_period
+        self.cpu_stop = self.wall_stop = None
+        self.started = False
+        self.nodes_used = 0
+        self.nodes_base = 0
+        # the limit that stopped a search: 'cpu_time', 'wall_time', 'nodes', 'memory' or None
+        self.limit_reached = None
+        self.limited = any(limit is not None for limit in (cpu_time, wall_time, nodes, memory))
+        self.interval = 1 if self.limited else sys.maxsize
+        self.checked_at = None
+        self.checked_nodes = 0
+
+    def start(self):
+        '''Start the clocks of the time limits, unless they were already started.'''
+        if not self.started:
+            self.started = True
+            if self.cpu_time:
+                self.cpu_stop = os.times()[0] + self.cpu_time
+            if self.wall_time:
+                self.wall_stop = time.monotonic() + self.wall_time
+
+    def begin(self, nodes):
+        '''Called by search when it starts, with the number of nodes created so far.'''
+        self.start()
+        self.nodes_base = nodes
+        self.limit_reached = None
+        if self.limited:
+            # check on the first expansion, in case the budget is already spent
+            self.interval = 1
+            self.checked_at = time.monotonic()
+            self.checked_nodes = nodes
+
+    def end(self, nodes):
+        '''Called by search when it returns, with the number of nodes created so far.'''
+        self.nodes_used += nodes - self.nodes_base
+        self.nodes_base = nodes
+
+    def time_left(self):
+        '''Return the seconds left before a time limit is reached, or None if there is no time limit.'''
+        left = []
+        if self.cpu_stop is not None:
+            left.append(self.cpu_stop - os.times()[0])
+        if self.wall_stop is not None:
+            left.append(self.wall_stop - time.monotonic())
+        return min(left) if left else None
+
+    def check(self, nodes):
+        '''
+        Check the limits after interval more expansions. Return True (and set limit_reached) if a
+        limit was reached, otherwise set the interval until the next check and return False.
+
+        @param nodes: the number of nodes created so far (sNode.n).
+        '''
+        if not self.limited:
+            return False
+        now = time.monotonic()
+        nodes_used = self.nodes_used + nodes - self.nodes_base
+        if self.cpu_stop is not None and os.times()[0] > self.cpu_stop:
+            self.limit_reached = 'cpu_time'
+        elif self.wall_stop is not None and now > self.wall_stop:
+            self.limit_reached = 'wall_time'
+        elif self.nodes is not None and nodes_used >= self.nodes:
+            self.limit_reached = 'nodes'
+        elif self.memory is not None and (_resident_memory() or 0) > self.memory:
+            self.limit_reached = 'memory'
+        if self.limit_reached:
+            if self.limit_reached in ('cpu_time', 'wall_time'):
+                print("TRACE: Search has exceeeded the time bound provided.")
+            else:
+                print("TRACE: Search has exceeded the {} limit provided.".format(self.limit_reached))
+            return True
+
+        elapsed = now - self.checked_at
+        self.checked_at = now
+        # expansions per second since the last check, and the seconds the next interval may take
+        if elapsed > 0:
+            interval = self.interval * self.check_period / elapsed
+        else:
+            interval = 2 * self.interval
+        left = self.time_left()
+        if left is not None and elapsed > 0:
+            interval = min(interval, self.interval * max(left, 0) / elapsed)
+        if self.nodes is not None:
+            # nodes created per expansion since the last check
+            per_expansion = max(1.0, (nodes - self.checked_nodes) / self.interval)
+            interval = min(interval, (self.nodes - nodes_used) / per_expansion)
+        self.checked_nodes = nodes
+        # grow at most twofold, as one fast stretch of the search says little about the next
+        self.interval = max(1, min(int(interval), 2 * self.interval))
+        return False
+
+
+# external_astar: a sparse index entry is kept for every _RUN_INDEX_STRIDE-th record of a
+# closed run, and the closed runs are merged into one when there are more than _CLOSED_RUNS.
+_RUN_INDEX_STRIDE = 64
+_CLOSED_RUNS = 8
+
+# the order of the records of a run: the hash of the state's key, then the g-value
+_record_order = itemgetter(0, 1)
+
+
+def _shared_objects(state):
+    '''
+    Return the attribute values that state shares (by identity) with all of its successors, such
+    as a Sokoban Level. external_astar writes a reference to them instead of a copy with each state.
+    '''
+    def attributes(s):
+        values = dict(getattr(s, '__dict__', {}))
+        for cls in type(s).__mro__:
+            slots = getattr(cls, '__slots__', ())
+            for name in (slots,) if isinstance(slots, str) else slots:
+                if hasattr(s, name):
+                    values[name] = getattr(s, name)
+        return values
+
+    generated = StateSpace.n
+    values = attributes(state)
+    for succ in state.successors():
+        succ_values = attributes(succ)
+        values = {name: value for name, value in values.items() if succ_values.get(name) is value}
+    StateSpace.n = generated
+    return [value for name, value in values.items()
+            if name != 'parent' and value is not None and not isinstance(value, (bool, int, float, str))]
+
+
+class _SpillPickler(pickle.Pickler):
+    '''Pickles the objects in shared_ids (id -> index) as references to their index.'''
+
+    def __init__(self, file, shared_ids):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.shared_ids = shared_ids
+
+    def persistent_id(self, obj):
+        return self.shared_ids.get(id(obj))
+
+
+class _SpillUnpickler(pickle.Unpickler):
+    '''Unpickles what _SpillPickler wrote, resolving the references to the list shared.'''
+
+    def __init__(self, file, shared):
+        pickle.Unpickler.__init__(self, file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+
+class _Run:
+    '''
+    A sorted run of external_astar: a file of records (hash of the state's key, g-value, h-value,
+    state without its parent, hash of the parent's key or None), appended in the order of
+    _record_order, with a sparse index (hash, file offset) of every _RUN_INDEX_STRIDE-th record.
+    '''
+
+    def __init__(self, path, shared, shared_ids):
+        self.path = path
+        self.shared = shared
+        self.index = []
+        self.count = 0
+        self.size = 0
+        self.file = open(path, 'wb')
+        self.pickler = _SpillPickler(self.file, shared_ids)
+
+    def append(self, record):
+        if self.count % _RUN_INDEX_STRIDE == 0:
+            self.index.append((record[0], self.file.tell()))
+        self.pickler.dump(record)
+        # don't let the memo keep the records in memory (or refer back to them)
+        self.pickler.clear_memo()
+        self.count += 1
+
+    def close(self):
+        '''Finish writing the run.'''
+        self.size = self.file.tell()
+        self.file.close()
+        self.file = self.pickler = None
+
+    def records(self, offset=0):
+        '''Generate the records of the (closed) run, starting from the one at offset.'''
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            unpickler = _SpillUnpickler(file, self.shared)
+            while True:
+                try:
+                    yield unpickler.load()
+                except EOFError:
+                    return
+
+    def lookup(self, hash_value):
+        '''Generate the records of the run with the given hash, reading from the index entry before them.'''
+        start = max(0, bisect_left(self.index, (hash_value,)) - 1)
+        if start >= len(self.index):
+            return
+        for record in self.records(self.index[start][1]):
+            if record[0] > hash_value:
+                return
+            if record[0] == hash_value:
+                yield record
+
+    def remove(self):
+        os.remove(self.path)
+
+
+class Tracer:
+    '''The hooks trace_on registers: they print each search event, with more detail at level 2.'''
+
+    def __init__(self, engine, level):
+        self.engine = engine
+        self.level = level
+
+    def on_expand(self, node):
+        print("   TRACE: Next State to expand: <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(
+            node.state.index, node.state.action, node.state.hashable_state(), node.gval, node.hval,
+            node.gval + node.hval))
+        if node.state.gval != node.gval:
+            print("ERROR: Node gval not equal to state gval!")
+        if self.engine.cycle_check == _CC_FULL:
+            print("   TRACE: CC_dict gval={}, node.gval={}".format(
+                self.engine.cc_dictionary[node.state.hashable_state()], node.gval))
+
+    def on_generate(self, node, parent):
+        print("   TRACE: Successor <S{}:{}:{}, g={}, h={}, f=g+h={}> added to OPEN".format(
+            node.state.index, node.state.action, node.state.hashable_state(), node.gval, node.hval,
+            node.gval + node.hval))
+        if self.level > 1:
+            node.state.print_state()
+            print("\n")
+
+    def on_prune(self, state, parent, reason):
+        if self.level > 1:
+            print("   TRACE: Successor State:", end="")
+            state.print_state()
+            if reason == 'cycle':
+                if self.engine.cycle_check == _CC_FULL:
+                    print("   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}".format(
+                        self.engine.cc_dictionary[state.hashable_state()], state.gval))
+                else:
+                    print("   TRACE: On cyclic path")
+                print(" TRACE: Successor State pruned by cycle checking")
+            else:
+                print(" TRACE: Successor State pruned, over current cost bound")
+            print("\n")
+
+    def on_goal(self, node):
+        print("   TRACE: Goal found: <S{}:{}:{}, g={}>".format(
+            node.state.index, node.state.action, node.state.hashable_state(), node.gval))
+
+
 class SearchEngine:
-    def __init__(self, strategy='depth_first', cc_level='default'):
-        self.set_strategy(strategy, cc_level)
+    def __init__(self, strategy='depth_first', cc_level='default', open_type='default'):
+        self.set_strategy(strategy, cc_level, open_type)
         self.trace = 0
+        self.tracer = None
+        self.profiling = False
+        self.hooks = {'on_expand': [], 'on_generate': [], 'on_prune': [], 'on_goal': []}
 
     def initStats(self):
         sNode.n = 0
         StateSpace.n = 1  # initial state already generated
         self.cycle_check_pruned = 0
         self.cost_bound_pruned = 0
+        self.profile = dict(successor_time=0.0, heuristic_time=0.0, cycle_check_time=0.0, open_time=0.0,
+                            peak_open=0, peak_closed=0)
 
     def trace_on(self, level=1):
         '''For debugging, set tracking level 1 or 2'''
+        self.trace_off()
         self.trace = level
+        self.tracer = Tracer(self, level)
+        for event in self.hooks:
+            self.add_hook(event, getattr(self.tracer, event))
 
     def trace_off(self):
         '''Turn off tracing'''
         self.trace = 0
+        if self.tracer is not None:
+            for event in self.hooks:
+                self.remove_hook(event, getattr(self.tracer, event))
+            self.tracer = None
 
-    def set_strategy(self, s, cc='default'):
-        if not s in ['depth_first', 'breadth_first', 'ucs', 'best_first', 'astar', 'custom']:
+    def profile_on(self):
+        '''
+        Time the phases of the search: successor generation, heuristic evaluation, cycle checking
+        and OPEN operations, and record the peak sizes of OPEN and the cycle check dictionary. The
+        totals (since init_search) are in the profile of the SearchStats returned by search. Only
+        the OPEN based strategies (all but idastar, arastar and hdastar) are profiled.
+        '''
+        self.profiling = True
+
+    def profile_off(self):
+        '''Turn off profiling'''
+        self.profiling = False
+
+    def add_hook(self, event, hook):
+        '''
+        Register a function to be called on a search event. When no hooks are registered the engine
+        runs a search loop without any hook (or tracing) calls, so they cost nothing unless used.
+        Hooks are called by the OPEN based strategies (all but idastar, arastar and hdastar).
+
+        @param event: one of
+            'on_expand': hook(node) before the successors of node are generated,
+            'on_generate': hook(node, parent) after node, a successor of parent, is inserted into OPEN,
+            'on_prune': hook(state, parent, reason) when a successor state of parent is discarded,
+                reason being 'cycle' (by cycle checking) or 'cost' (by the costbound),
+            'on_goal': hook(node) when a goal node is extracted from OPEN.
+        @param hook: the function to call.
+        '''
+        if event not in self.hooks:
+            print('Unknown hook event', event)
+            print("Must be one of", list(self.hooks))
+        else:
+            self.hooks[event].append(hook)
+
+    def remove_hook(self, event, hook):
+        '''Unregister a hook registered with add_hook.'''
+        if hook in self.hooks.get(event, ()):
+            self.hooks[event].remove(hook)
+
+    def set_strategy(self, s, cc='default', open_type='default'):
+        if not s in ['depth_first', 'breadth_first', 'ucs', 'best_first', 'astar', 'custom', 'idastar', 'arastar',
+                         'hdastar', 'smastar', 'external_astar']:
             print('Unknown search strategy specified:', s)
-            print("Must be one of 'depth_first', 'ucs', 'breadth_first', 'best_first', 'custom' or 'astar'")
+            print("Must be one of 'depth_first', 'ucs', 'breadth_first', 'best_first', 'custom', 'astar', 'idastar',",
+                  "'arastar', 'hdastar', 'smastar' or 'external_astar'")
         elif not cc in ['default', 'none', 'path', 'full']:
             print('Unknown cycle check level', cc)
             print("Must be one of ['default', 'none', 'path', 'full']")
+        elif not open_type in ['default', 'heap', 'bucket']:
+            print('Unknown OPEN type', open_type)
+            print("Must be one of ['default', 'heap', 'bucket']")
 
         else:
+            if open_type == 'heap':
+                self.open_type = _OPEN_HEAP
+            else:
+                self.open_type = _OPEN_BUCKET
+
             if cc == 'default':
-                if s == 'depth_first':
+                if s == 'depth_first' or s == 'idastar' or s == 'smastar':
                     self.cycle_check = _CC_PATH
                 else:
                     self.cycle_check = _CC_FULL
@@ -333,6 +999,25 @@ class SearchEngine:
                 self.strategy = _ASTAR
             elif s == 'custom':
                 self.strategy = _CUSTOM
+            elif s == 'idastar':
+                self.strategy = _IDASTAR
+            elif s == 'arastar':
+                self.strategy = _ARASTAR
+                # ARA* relies on the g-values remembered by full cycle checking
+                self.cycle_check = _CC_FULL
+            elif s == 'hdastar':
+                self.strategy = _HDASTAR
+                # each worker does full cycle checking on the states it owns
+                self.cycle_check = _CC_FULL
+            elif s == 'smastar':
+                self.strategy = _SMASTAR
+                # forgotten states can't stay in a cycle check dictionary
+                if self.cycle_check == _CC_FULL:
+                    self.cycle_check = _CC_PATH
+            elif s == 'external_astar':
+                self.strategy = _EXTERNAL
+                # duplicates are always detected, against the closed runs on disk
+                self.cycle_check = _CC_FULL
 
     def get_strategy(self):
         if self.strategy == _DEPTH_FIRST:
@@ -347,6 +1032,16 @@ class SearchEngine:
             rval = 'astar'
         elif self.strategy == _CUSTOM:
             rval = 'custom'
+        elif self.strategy == _IDASTAR:
+            rval = 'idastar'
+        elif self.strategy == _ARASTAR:
+            rval = 'arastar'
+        elif self.strategy == _HDASTAR:
+            rval = 'hdastar'
+        elif self.strategy == _SMASTAR:
+            rval = 'smastar'
+        elif self.strategy == _EXTERNAL:
+            rval = 'external_astar'
 
         rval = rval + ' with '
 
@@ -359,14 +1054,37 @@ class SearchEngine:
 
         return rval
 
-    def init_search(self, initState, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function):
+    def init_search(self, initState, goal_fn, heur_fn=_zero_hfn, fval_function=_fval_function, heur_cache_size=None,
+                    tt_size=0, weight=1, workers=None, batch_size=32, compact_paths=False, memory_limit=None,
+                    buffer_size=100000, spill_dir=None):
         """
         Get ready to search. Call search on this object to run the search.
 
         @param initState: the state of the puzzle to start the search from.
         @param goal_fn: the goal function for the puzzle
-        @param heur_fn: the heuristic function to use (only relevant for search strategies that use heuristics)
+        @param heur_fn: the heuristic function to use (only relevant for search strategies that use heuristics),
+            or an IncrementalHeuristic
         @param fval_fn: the f-value function (only relevant for custom search strategy)
+        @param heur_cache_size: if given, memoize up to this many heuristic values (see HeuristicCache)
+        @param tt_size: idastar only, the number of states the transposition table may hold (0 for none)
+        @param weight: arastar only, the initial weight w of the f-value g + w * h (see set_weight)
+        @param workers: hdastar only, the number of worker processes (default: one per CPU)
+        @param batch_size: hdastar only, the number of successors a worker collects for another
+            worker before sending them (see _searchHDA)
+        @param compact_paths: don't keep the parent and action of the states that are inserted into
+            OPEN. Instead record, for each of them, the entry of its parent and a small integer code
+            for its action in two arrays, and rebuild the path (by replaying the actions from the initial
+            state) only for the goal that is returned. Expanded states then no longer stay in memory
+            through their children's parent references. Needs successors to be deterministic, and is
+            not available with path checking (which walks the parents), idastar, arastar, hdastar, smastar
+            or external_astar.
+        @param memory_limit: smastar only, the number of nodes the search may keep in memory, or a string
+            such as '200MB' for a number of bytes (converted to nodes with an estimate of the size of a
+            node, see _estimated_node_size). Default: no limit.
+        @param buffer_size: external_astar only, the number of generated states kept in memory before
+            they are written to disk as sorted runs (see _searchExternal)
+        @param spill_dir: external_astar only, the directory for the runs (default: the system's
+            temporary directory). They are removed when the SearchEngine is.
         """
         # Perform full cycle checking as follows
         # a. check state before inserting into OPEN. If we had already reached
@@ -386,9 +1104,91 @@ class SearchEngine:
             print("   TRACE: Initial State:", end="")
             initState.print_state()
         # END
-        self.open = Open(self.strategy)
+        if self.strategy == _ARASTAR:
+            # OPEN is ordered on g + weight * h, see set_weight
+            self.weight = weight
+            fval_function = self._ara_fval
+            self.open = Open(_CUSTOM, self.open_type)
+            self.closed = set()
+            self.incons = []
+            self.incumbent = None
+        elif self.strategy in (_IDASTAR, _HDASTAR, _SMASTAR, _EXTERNAL):
+            self.open = None
+        else:
+            self.open = Open(self.strategy, self.open_type)
+
+        self.heur_cache = None
+        if heur_cache_size:
+            self.heur_cache = HeuristicCache(heur_fn, heur_cache_size)
+        self.heuristic = _Heuristic(self.heur_cache or heur_fn)
+        hval, hinfo = self.heuristic.evaluate(initState.hashable_state(), initState, None, None)
+        node = sNode(initState, hval, fval_function, hinfo)
+
+        self.fval_function = fval_function
+        self.goal_fn = goal_fn
+        self.heur_fn = heur_fn
 
-        node = sNode(initState, heur_fn(initState), fval_function)
+        self.compact_paths = False
+        if compact_paths:
+            if self.strategy in (_IDASTAR, _ARASTAR, _HDASTAR, _SMASTAR, _EXTERNAL) or self.cycle_check == _CC_PATH:
+                print('compact_paths is not available with', self.get_strategy())
+            else:
+                # entry 0 is the initial state; entry i has parent entry path_parents[i] and action
+                # code path_actions[i], the code of an action being its value in action_codes
+                self.compact_paths = True
+                self.initial_state = initState
+                self.path_parents = array('l', [-1])
+                self.path_actions = array('l', [0])
+                self.action_codes = {initState.action: 0}
+                node.entry = 0
+
+        if self.strategy == _IDASTAR:
+            # no OPEN or cycle check dictionary: the search is a generator that
+            # suspends each time it finds a goal (or runs out of time)
+            self.iterations = []
+            self.ida_search = self._searchIDA(node, goal_fn, self.heuristic, tt_size)
+            return
+        if self.strategy == _HDASTAR:
+            # the workers own OPEN and the cycle check dictionary, see _searchHDA
+            self.root = node
+            self.workers = workers or os.cpu_count() or 1
+            self.batch_size = batch_size
+            return
+        if self.strategy == _SMASTAR:
+            # the search tree, with OPEN its leaves, see _searchSMA
+            if isinstance(memory_limit, str):
+                # (at least the root, which is never forgotten)
+                memory_limit = max(1, _parse_bytes(memory_limit) // _estimated_node_size(node))
+            self.memory_limit = math.inf if memory_limit is None else memory_limit
+            self.sma_best = []
+            self.sma_worst = []
+            self.sma_size = 1
+            self.states_forgotten = 0
+            node.fval = node.gval + node.hval
+            node.depth = 0
+            node.sma_parent = None
+            node.sma_key = initState.hashable_state()
+            node.sma_children = []
+            node.sma_forgotten = math.inf
+            node.sma_version = 0
+            self._sma_push(node)
+            return
+        if self.strategy == _EXTERNAL:
+            # OPEN (one list of runs for each f-value) and closed are sorted runs on disk, see _searchExternal
+            self.initial_state = initState
+            self.buffer_size = buffer_size
+            self.spill_dir = tempfile.TemporaryDirectory(prefix='search-', dir=spill_dir)
+            self.shared = _shared_objects(initState)
+            self.shared_ids = {id(obj): index for index, obj in enumerate(self.shared)}
+            self.layers = dict()
+            self.buffers = dict()
+            self.buffered = 0
+            self.closed_runs = []
+            self.runs_written = 0
+            self.bytes_spilled = 0
+            self._ext_push(node.gval + node.hval, (hash(initState.hashable_state()), initState.gval, node.hval,
+                                                   initState, None))
+            return
 
         # the cycle check dictionary stores the cheapest path (g-val) found
         # so far to a state.
@@ -397,16 +1197,16 @@ class SearchEngine:
             self.cc_dictionary[initState.hashable_state()] = initState.gval
 
         self.open.insert(node)
-        self.fval_function = fval_function
-        self.goal_fn = goal_fn
-        self.heur_fn = heur_fn
 
-    def search(self, timebound=None, costbound=None):
+    def search(self, timebound=None, costbound=None, budget=None):
         """
         Start searching, using the parameters set by init_search.
 
-        @param timebound: the maximum amount of time, in seconds, to spend on this search.
+        @param timebound: the maximum amount of time, in seconds, to spend on this search. Short for
+            budget=SearchBudget(cpu_time=timebound).
         @param costbound: the cost bound 3-tuple for pruning, as specified in the assignment.
+        @param budget: a SearchBudget with the limits of the search (instead of timebound). The limit
+            that stopped the search, if any, is reported as limit_reached in the SearchStats.
 
         This code will return a goal path (if one is found) as well as a SearchStat object containing
         statistics about the given search (assuming a solution is found).
@@ -414,14 +1214,59 @@ class SearchEngine:
 
         ###NOW do the search and return the result
         self.search_start_time = os.times()[0]
-        self.search_stop_time = None
-        if timebound:
-            self.search_stop_time = self.search_start_time + timebound
-
-        goal_node = self._searchOpen(self.goal_fn, self.heur_fn, self.fval_function, costbound)
+        if budget is None:
+            budget = SearchBudget(cpu_time=timebound)
+        elif timebound:
+            print('Error: give search either a timebound or a budget, not both. Ignoring the timebound.')
+        self.budget = budget
+        budget.begin(sNode.n)
+
+        if self.strategy == _HDASTAR:
+            if budget.nodes is not None or budget.memory is not None:
+                print('Error: hdastar only supports the time limits of a budget.')
+            # this process hardly uses CPU time while the workers search, so the time limits
+            # become one wall clock deadline, the nearer of the two
+            cpu_left = budget.cpu_stop - os.times()[0] if budget.cpu_stop is not None else math.inf
+            wall_left = budget.wall_stop - time.monotonic() if budget.wall_stop is not None else math.inf
+            goal, stats = self._searchHDA(budget.time_left(), costbound)
+            if self.hda_timed_out:
+                budget.limit_reached = 'cpu_time' if cpu_left <= wall_left else 'wall_time'
+            stats.limit_reached = budget.limit_reached
+            return goal, stats
+        if self.strategy == _IDASTAR:
+            self.costbound = costbound
+            goal_node = next(self.ida_search, False)
+        elif self.strategy == _ARASTAR:
+            goal_node = self._searchARA(self.goal_fn, self.heuristic, costbound)
+        elif self.strategy == _SMASTAR:
+            goal_node = self._searchSMA(self.goal_fn, self.heuristic, costbound)
+        elif self.strategy == _EXTERNAL:
+            goal_node = self._searchExternal(self.goal_fn, self.heuristic, costbound)
+        else:
+            instrumented = self.profiling or any(self.hooks.values())
+            search_open = self._searchOpenInstrumented if instrumented else self._searchOpen
+            goal_node = search_open(self.goal_fn, self.heuristic, self.fval_function, costbound)
 
         total_search_time = os.times()[0] - self.search_start_time
+        budget.end(sNode.n)
         stats = SearchStats(sNode.n, StateSpace.n, self.cycle_check_pruned, self.cost_bound_pruned, total_search_time)
+        stats.limit_reached = budget.limit_reached
+        if self.heur_cache:
+            stats.heur_cache_hits = self.heur_cache.hits
+            stats.heur_cache_misses = self.heur_cache.misses
+        if self.strategy == _IDASTAR:
+            stats.iterations = [tuple(iteration) for iteration in self.iterations]
+        if self.strategy == _SMASTAR:
+            stats.states_forgotten = self.states_forgotten
+        if self.strategy == _EXTERNAL:
+            stats.bytes_spilled = self.bytes_spilled
+        if self.profiling and self.open is not None and self.strategy != _ARASTAR:
+            stats.profile = dict(self.profile)
+
+        if goal_node and self.compact_paths:
+            return self._rebuild_path(goal_node), stats
+        if goal_node and self.strategy == _EXTERNAL:
+            return self._ext_path(goal_node), stats
 
         if goal_node:
             return goal_node.state, stats
@@ -430,39 +1275,33 @@ class SearchEngine:
 
     def _searchOpen(self, goal_fn, heur_fn, fval_function, costbound):
         """
-        Search, starting from self.open.
+        Search, starting from self.open. This is the loop used when no hooks are registered, so it
+        makes no tracing, hook or profiling calls at all; _searchOpenInstrumented is the same
+        loop with them.
 
         @param goal_fn: the goal function.
-        @param heur_fn: the heuristic function.
+        @param heur_fn: the heuristic (a _Heuristic).
         @param fval_function: the f-value function (only relevant when using a custom search strategy).
         @param costbound: the cost bound 3-tuple, as described in the assignment.
         """
-        # BEGIN TRACING
-        if self.trace:
-            print("   TRACE: Initial OPEN: ", self.open.print_open())
-            if self.cycle_check == _CC_FULL:
-                print("   TRACE: Initial CC_Dict:", self.cc_dictionary)
-        # END TRACING
+        evaluate = heur_fn.evaluate
+        compact_paths = self.compact_paths
+        if compact_paths:
+            path_parents, path_actions, action_codes = self.path_parents, self.path_actions, self.action_codes
+        budget = self.budget
+        countdown = budget.interval
         while not self.open.empty():
             node = self.open.extract()
 
-            # BEGIN TRACING
-            if self.trace:
-                print("   TRACE: Next State to expand: <S{}:{}:{}, g={}, h={}, f=g+h={}>".format(
-                    node.state.index, node.state.action, node.state.hashable_state(), node.gval, node.hval,
-                    node.gval + node.hval))
-                if node.state.gval != node.gval:
-                    print("ERROR: Node gval not equal to state gval!")
-
-            # END TRACING
             if goal_fn(node.state):
                 # node at front of OPEN is a goal...search is completed.
                 return node
-            if self.search_stop_time:  # timebound check
-                if os.times()[0] > self.search_stop_time:
-                    # exceeded time bound, must terminate search
-                    print("TRACE: Search has exceeeded the time bound provided.")
+            countdown -= 1
+            if not countdown:  # budget check, every budget.interval expansions
+                if budget.check(sNode.n):
+                    # exceeded a limit, must terminate search
                     return False
+                countdown = budget.interval
 
             # All states reached by a search node on OPEN have already
             # been hashed into the self.cc_dictionary. However,
@@ -470,48 +1309,11 @@ class SearchEngine:
             # an equivalent state with lower g-value. So only expand
             # the node if the hashed g-value is no greater than the
             # node's current g-value.
-
-            # BEGIN TRACING
-            if self.trace:
-                if self.cycle_check == _CC_FULL: print("   TRACE: CC_dict gval={}, node.gval={}".format(
-                    self.cc_dictionary[node.state.hashable_state()], node.gval))
-            # END TRACING
-
             if self.cycle_check == _CC_FULL and self.cc_dictionary[node.state.hashable_state()] < node.gval:
                 continue
 
-            successors = node.state.successors()
-
-            # BEGIN TRACING
-            if self.trace:
-                print("   TRACE: Expanding Node. Successors = {", end="")
-                for ss in successors:
-                    print("<S{}:{}:{}, g={}, h={}, f=g+h={}>, ".format(
-                        ss.index, ss.action, ss.hashable_state(), ss.gval, heur_fn(ss), ss.gval + heur_fn(ss)), end="")
-                print("}")
-            # END TRACING
-
-            for succ in successors:
+            for succ in node.state.successors():
                 hash_state = succ.hashable_state()
-                if self.trace > 1:
-                    if self.cycle_check == _CC_FULL and hash_state in self.cc_dictionary:
-                        print("   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}".format(
-                            self.cc_dictionary[hash_state], succ.gval))
-
-                        # BEGIN TRACING
-                if self.trace > 1:
-                    print("   TRACE: Successor State:", end="")
-                    succ.print_state()
-                    print("   TRACE: Heuristic Value:", heur_fn(succ))
-
-                    if self.cycle_check == _CC_FULL and hash_state in self.cc_dictionary:
-                        print("   TRACE: Already in CC_dict, CC_dict gval={}, successor state gval={}".format(
-                            self.cc_dictionary[hash_state], succ.gval))
-
-                    if self.cycle_check == _CC_PATH and succ.has_path_cycle():
-                        print("   TRACE: On cyclic path")
-                # END TRACING
-
                 prune_succ = (self.cycle_check == _CC_FULL and
                               hash_state in self.cc_dictionary and
                               succ.gval > self.cc_dictionary[hash_state]
@@ -522,31 +1324,21 @@ class SearchEngine:
 
                 if prune_succ:
                     self.cycle_check_pruned = self.cycle_check_pruned + 1
-                    # BEGIN TRACING
-                    if self.trace > 1:
-                        print(" TRACE: Successor State pruned by cycle checking")
-                        print("\n")
-                        # END TRACING
                     continue
 
-                succ_hval = heur_fn(succ)
-                if costbound is not None and (succ.gval > costbound[0] or
-                                              succ_hval > costbound[1] or
-                                              succ.gval + succ_hval > costbound[2]):
+                succ_hval, succ_hinfo = evaluate(hash_state, succ, node.state, node.hinfo)
+                if _over_bound(costbound, succ.gval, succ_hval):
                     self.cost_bound_pruned = self.cost_bound_pruned + 1
-                    if self.trace > 1:
-                        print(" TRACE: Successor State pruned, over current cost bound of {}", costbound)
-                        print("\n")
                     continue
 
-                    # passed all cycle checks and costbound checks ...add to open
-                self.open.insert(sNode(succ, succ_hval, node.fval_function))
-
-                # BEGIN TRACING
-                if self.trace > 1:
-                    print(" TRACE: Successor State added to OPEN")
-                    print("\n")
-                # END TRACING
+                # passed all cycle checks and costbound checks ...add to open
+                succ_node = sNode(succ, succ_hval, node.fval_function, succ_hinfo)
+                if compact_paths:
+                    succ_node.entry = len(path_parents)
+                    path_parents.append(node.entry)
+                    path_actions.append(action_codes.setdefault(succ.action, len(action_codes)))
+                    succ.parent = succ.action = None
+                self.open.insert(succ_node)
 
                 # record cost of this path in dictionary.
                 if self.cycle_check == _CC_FULL:
@@ -555,4 +1347,969 @@ class SearchEngine:
         # end of while--OPEN is empty and no solution
         return False
 
+    def _searchOpenInstrumented(self, goal_fn, heur_fn, fval_function, costbound):
+        """
+        _searchOpen with calls to the registered hooks (see add_hook) and with the timing of its
+        phases (see profile_on), used when there are any hooks or profiling is on.
+        """
+        # BEGIN TRACING
+        if self.trace:
+            print("   TRACE: Initial OPEN: ", self.open.print_open())
+            if self.cycle_check == _CC_FULL:
+                print("   TRACE: Initial CC_Dict:", self.cc_dictionary)
+        # END TRACING
+        on_expand = self.hooks['on_expand']
+        on_generate = self.hooks['on_generate']
+        on_prune = self.hooks['on_prune']
+        on_goal = self.hooks['on_goal']
+        evaluate = heur_fn.evaluate
+        compact_paths = self.compact_paths
+        if compact_paths:
+            path_parents, path_actions, action_codes = self.path_parents, self.path_actions, self.action_codes
+        budget = self.budget
+        countdown = budget.interval
+        clock = time.perf_counter
+        successor_time = heuristic_time = cycle_check_time = open_time = 0.0
+        open_size = peak_open = len(self.open.nodes())
+        try:
+            while not self.open.empty():
+                start = clock()
+                node = self.open.extract()
+                open_time += clock() - start
+                open_size -= 1
+
+                if goal_fn(node.state):
+                    for hook in on_goal:
+                        hook(node)
+                    return node
+                countdown -= 1
+                if not countdown:  # budget check
+                    if budget.check(sNode.n):
+                        return False
+                    countdown = budget.interval
+
+                start = clock()
+                stale = self.cycle_check == _CC_FULL and self.cc_dictionary[node.state.hashable_state()] < node.gval
+                cycle_check_time += clock() - start
+                if stale:
+                    continue
+
+                for hook in on_expand:
+                    hook(node)
+
+                start = clock()
+                successors = node.state.successors()
+                successor_time += clock() - start
+
+                for succ in successors:
+                    start = clock()
+                    hash_state = succ.hashable_state()
+                    prune_succ = (self.cycle_check == _CC_FULL and
+                                  hash_state in self.cc_dictionary and
+                                  succ.gval > self.cc_dictionary[hash_state]
+                                  ) or (
+                                         self.cycle_check == _CC_PATH and
+                                         succ.has_path_cycle()
+                                 )
+                    cycle_check_time += clock() - start
+
+                    if prune_succ:
+                        self.cycle_check_pruned = self.cycle_check_pruned + 1
+                        for hook in on_prune:
+                            hook(succ, node, 'cycle')
+                        continue
+
+                    start = clock()
+                    succ_hval, succ_hinfo = evaluate(hash_state, succ, node.state, node.hinfo)
+                    heuristic_time += clock() - start
+                    if _over_bound(costbound, succ.gval, succ_hval):
+                        self.cost_bound_pruned = self.cost_bound_pruned + 1
+                        for hook in on_prune:
+                            hook(succ, node, 'cost')
+                        continue
+
+                    start = clock()
+                    succ_node = sNode(succ, succ_hval, node.fval_function, succ_hinfo)
+                    open_time += clock() - start
+                    # (before compact_paths cuts the successor's parent and action)
+                    for hook in on_generate:
+                        hook(succ_node, node)
+
+                    start = clock()
+                    if compact_paths:
+                        succ_node.entry = len(path_parents)
+                        path_parents.append(node.entry)
+                        path_actions.append(action_codes.setdefault(succ.action, len(action_codes)))
+                        succ.parent = succ.action = None
+                    self.open.insert(succ_node)
+                    open_time += clock() - start
+                    open_size += 1
+                    if open_size > peak_open:
+                        peak_open = open_size
+
+                    if self.cycle_check == _CC_FULL:
+                        start = clock()
+                        self.cc_dictionary[hash_state] = succ.gval
+                        cycle_check_time += clock() - start
+
+            return False
+        finally:
+            profile = self.profile
+            profile['successor_time'] += successor_time
+            profile['heuristic_time'] += heuristic_time
+            profile['cycle_check_time'] += cycle_check_time
+            profile['open_time'] += open_time
+            profile['peak_open'] = max(profile['peak_open'], peak_open)
+            if self.cycle_check == _CC_FULL:
+                # entries are only removed by tighten_bound, so the dictionary is largest now
+                profile['peak_closed'] = max(profile['peak_closed'], len(self.cc_dictionary))
+
+    def _rebuild_path(self, node):
+        """
+        With compact_paths, rebuild the path to a goal node from the entries recorded for it:
+        follow the parent entries back to the initial state, then replay the actions from there.
+
+        @param node: the goal node (whose state has no parent).
+        @return: the goal state, with its path restored.
+        """
+        codes = []
+        entry = node.entry
+        while entry > 0:
+            codes.append(self.path_actions[entry])
+            entry = self.path_parents[entry]
+        actions = {code: action for action, code in self.action_codes.items()}
+        state = self.initial_state
+        for code in reversed(codes):
+            action = actions[code]
+            state = next(succ for succ in state.successors() if succ.action == action)
+        if state.hashable_state() != node.state.hashable_state():
+            print("ERROR: Rebuilt path does not end in the goal state!")
+        return state
+
+    def tighten_bound(self, costbound):
+        """
+        Prune everything that the cost bound 3-tuple rules out right away, instead of leaving the
+        hopeless nodes on OPEN to be popped and discarded one at a time. OPEN (and, for arastar,
+        INCONS) is filtered and re-heapified in a single pass, and the cycle check dictionary
+        entries of the removed nodes are dropped, as are all entries with a g-value above the
+        bound on g. This frees their memory at once. It is meant to be followed by calls to search
+        with a costbound at least as tight, which prune the same states should they be reached again.
+
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+        """
+        if self.strategy == _IDASTAR or self.strategy == _HDASTAR:
+            # nothing is stored here: the costbound passed to search already applies to the next node
+            return
+        if self.strategy == _SMASTAR:
+            # the leaves over the costbound passed to search are forgotten as they are reached
+            return
+        if self.strategy == _EXTERNAL:
+            # the runs are only read as their f-layer is expanded, which applies the costbound
+            return
+
+        def over_bound(node):
+            return _over_bound(costbound, node.gval, node.hval)
+
+        removed = self.open.remove(over_bound)
+        if self.strategy == _ARASTAR:
+            removed.extend(node for node in self.incons if over_bound(node))
+            self.incons = [node for node in self.incons if not over_bound(node)]
+        self.cost_bound_pruned = self.cost_bound_pruned + len(removed)
+
+        if self.cycle_check == _CC_FULL:
+            for node in removed:
+                hash_state = node.state.hashable_state()
+                if self.cc_dictionary.get(hash_state) == node.gval:
+                    del self.cc_dictionary[hash_state]
+            if costbound[0] < math.inf:
+                self.cc_dictionary = {hash_state: gval for hash_state, gval in self.cc_dictionary.items()
+                                      if gval <= costbound[0]}
+
+    def _ara_fval(self, node):
+        return node.gval + self.weight * node.hval
+
+    def set_weight(self, weight):
+        """
+        Anytime Repairing A* (arastar): change the weight of the f-value g + weight * h for the
+        next call to search. Rather than restarting, the search continues from its current OPEN:
+        the states in INCONS (those whose g-value improved after they had been expanded in the
+        previous call) are moved back into OPEN, OPEN is re-sorted on the new f-values and the
+        CLOSED set is emptied, so the next call only repairs the part of the search the new
+        weight affects.
+
+        @param weight: the new weight, usually lower than the previous one.
+        """
+        self.weight = weight
+        nodes = self.open.nodes() + self.incons
+        self.open = Open(_CUSTOM, self.open_type)
+        for node in nodes:
+            # skip entries superseded by a cheaper path to the same state
+            if self.cc_dictionary[node.state.hashable_state()] == node.gval:
+                self.open.insert(node)
+        self.incons = []
+        self.closed = set()
+
+    def _searchARA(self, goal_fn, heur_fn, costbound):
+        """
+        One improvement pass of Anytime Repairing A* with the current weight. Nodes are expanded
+        in order of g + weight * h, each state at most once per pass (the CLOSED set). A state
+        reached by a cheaper path after it was expanded in this pass goes to INCONS instead of
+        OPEN, to be reconsidered once set_weight starts the next pass. The pass ends with the
+        first goal extracted from OPEN, which becomes the incumbent, or returns False when no
+        node on OPEN has a smaller f-value than the incumbent (so the weight must be lowered
+        for a better solution) or OPEN is empty.
+
+        @param goal_fn: the goal function.
+        @param heur_fn: the heuristic (a _Heuristic).
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+        """
+        evaluate = heur_fn.evaluate
+        closed = self.closed
+        budget = self.budget
+        countdown = budget.interval
+        while not self.open.empty():
+            node = self.open.extract()
+            key = node.state.hashable_state()
+            if self.cc_dictionary[key] < node.gval or key in closed:
+                # stale entry, or the state was already expanded in this pass
+                continue
+            if self.incumbent is not None and self._ara_fval(node) >= self._ara_fval(self.incumbent):
+                # nothing left on OPEN can improve on the incumbent at this weight
+                self.open.insert(node)
+                return False
+            closed.add(key)
+            if goal_fn(node.state):
+                self.incumbent = node
+                return node
+            countdown -= 1
+            if not countdown:
+                if budget.check(sNode.n):
+                    closed.discard(key)
+                    self.open.insert(node)
+                    return False
+                countdown = budget.interval
+
+            for succ in node.state.successors():
+                hash_state = succ.hashable_state()
+                if hash_state in self.cc_dictionary and succ.gval >= self.cc_dictionary[hash_state]:
+                    self.cycle_check_pruned = self.cycle_check_pruned + 1
+                    continue
+
+                succ_hval, succ_hinfo = evaluate(hash_state, succ, node.state, node.hinfo)
+                if _over_bound(costbound, succ.gval, succ_hval):
+                    self.cost_bound_pruned = self.cost_bound_pruned + 1
+                    continue
+
+                self.cc_dictionary[hash_state] = succ.gval
+                succ_node = sNode(succ, succ_hval, self._ara_fval, succ_hinfo)
+                if hash_state in closed:
+                    self.incons.append(succ_node)
+                else:
+                    self.open.insert(succ_node)
+
+        return False
+
+    def _sma_push(self, node):
+        '''
+        Put node on OPEN, or update its entry: a leaf with its f-value, a node with forgotten children
+        (and others still in memory) with the least f-value of those. Only leaves can be forgotten.
+        '''
+        node.sma_version += 1
+        node.in_open = True
+        if node.sma_children:
+            heapq.heappush(self.sma_best, (node.sma_forgotten, -node.depth, node.index, node.sma_version, node))
+        else:
+            heapq.heappush(self.sma_best, (node.fval, -node.depth, node.index, node.sma_version, node))
+            heapq.heappush(self.sma_worst, (-node.fval, node.depth, -node.index, node.sma_version, node))
+
+    def _sma_peek(self, heap):
+        '''Return the first node on heap (sma_best or sma_worst), dropping outdated entries, or None.'''
+        while heap:
+            entry = heap[0]
+            if entry[4].in_open and entry[3] == entry[4].sma_version:
+                return entry[4]
+            heapq.heappop(heap)
+        return None
+
+    def _sma_forget(self, node, fval):
+        '''
+        Remove the leaf node from the tree, backing its f-value fval up into its parent. The parent
+        remembers the least f-value of its forgotten children and is on OPEN with it, to regenerate
+        them should it become the least on OPEN. Once all of its children are forgotten the parent is
+        a leaf again, whose f-value is (at least) that least f-value.
+        '''
+        node.in_open = False
+        parent = node.sma_parent
+        node.sma_parent = None
+        self.sma_size -= 1
+        parent.sma_children.remove(node)
+        parent.sma_forgotten = min(parent.sma_forgotten, fval)
+        if not parent.sma_children:
+            parent.fval = max(parent.fval, parent.sma_forgotten)
+            parent.sma_forgotten = math.inf
+        self._sma_push(parent)
+
+    def _searchSMA(self, goal_fn, heur_fn, costbound):
+        """
+        Simplified memory-bounded A* (SMA*). The search keeps its tree in memory and expands the
+        node on OPEN with the least f-value (the deepest on ties), generating all of its successors
+        at once. The f-value of a child is at least that of its parent (pathmax). When the tree has
+        more than memory_limit nodes, the worst leaves (greatest f-value, shallowest on ties) are
+        forgotten until it fits again or the worst leaf is also the best node on OPEN. The f-value
+        of a forgotten leaf is backed up into its parent (see _sma_forget), which goes on OPEN with
+        the least f-value of its forgotten children and, when extracted, generates those children
+        again. So the search degrades to regenerating parts of the tree instead of running out of
+        memory. The limit is soft: it can be exceeded by the successors of one expansion.
+
+        The first goal extracted is returned (optimal for an admissible heuristic if the memory allows
+        the tree to hold an optimal path). The search can be resumed with a tighter costbound, leaves
+        over the costbound are forgotten as they are extracted.
+
+        @param goal_fn: the goal function.
+        @param heur_fn: the heuristic (a _Heuristic).
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+        """
+        evaluate = heur_fn.evaluate
+        path_check = self.cycle_check != _CC_NONE
+        best_heap, worst_heap = self.sma_best, self.sma_worst
+        budget = self.budget
+        countdown = budget.interval
+        while True:
+            node = self._sma_peek(best_heap)
+            if node is None or best_heap[0][0] == math.inf:
+                # nothing left, or everything left was forgotten as hopeless
+                return False
+            heapq.heappop(best_heap)
+            node.in_open = False
+
+            regenerating = bool(node.sma_children)
+            if regenerating:
+                # generate the forgotten children again, with at least their backed up f-value
+                in_memory = {child.sma_key for child in node.sma_children}
+                least_fval = max(node.fval, node.sma_forgotten)
+                node.sma_forgotten = math.inf
+            else:
+                if _over_bound(costbound, node.gval, node.hval):
+                    self.cost_bound_pruned = self.cost_bound_pruned + 1
+                    if node.sma_parent is None:
+                        return False
+                    self._sma_forget(node, math.inf)
+                    continue
+                if goal_fn(node.state):
+                    # don't return the same goal again if the search is resumed
+                    if node.sma_parent is not None:
+                        self._sma_forget(node, math.inf)
+                    return node
+                in_memory = ()
+                least_fval = node.fval
+            countdown -= 1
+            if not countdown:
+                if budget.check(sNode.n):
+                    if regenerating:
+                        node.sma_forgotten = least_fval
+                    self._sma_push(node)
+                    return False
+                countdown = budget.interval
+
+            children = []
+            for succ in node.state.successors():
+                succ_key = succ.hashable_state()
+                if succ_key in in_memory:
+                    continue
+                if path_check:
+                    ancestor = node
+                    while ancestor is not None and ancestor.sma_key != succ_key:
+                        ancestor = ancestor.sma_parent
+                    if ancestor is not None:
+                        self.cycle_check_pruned = self.cycle_check_pruned + 1
+                        continue
+                succ_hval, succ_hinfo = evaluate(succ_key, succ, node.state, node.hinfo)
+                if _over_bound(costbound, succ.gval, succ_hval):
+                    self.cost_bound_pruned = self.cost_bound_pruned + 1
+                    continue
+                child = sNode(succ, succ_hval, node.fval_function, succ_hinfo)
+                child.fval = max(least_fval, succ.gval + succ_hval)
+                child.depth = node.depth + 1
+                child.sma_parent = node
+                child.sma_key = succ_key
+                child.sma_children = []
+                child.sma_forgotten = math.inf
+                child.sma_version = 0
+                children.append(child)
+
+            if not children and not node.sma_children:
+                # a dead end
+                if node.sma_parent is None:
+                    return False
+                self._sma_forget(node, math.inf)
+                continue
+            node.sma_children.extend(children)
+            self.sma_size += len(children)
+            for child in children:
+                self._sma_push(child)
+
+            while self.sma_size > self.memory_limit:
+                worst = self._sma_peek(worst_heap)
+                if worst is None or worst is self._sma_peek(best_heap):
+                    break
+                heapq.heappop(worst_heap)
+                self._sma_forget(worst, worst.fval)
+                self.states_forgotten += 1
+
+            if len(best_heap) + len(worst_heap) > 4 * self.sma_size + 64:
+                # drop the outdated entries, which keep forgotten nodes in memory
+                self.sma_best = best_heap = [entry for entry in best_heap
+                                             if entry[4].in_open and entry[3] == entry[4].sma_version]
+                self.sma_worst = worst_heap = [entry for entry in worst_heap
+                                               if entry[4].in_open and entry[3] == entry[4].sma_version]
+                heapq.heapify(best_heap)
+                heapq.heapify(worst_heap)
+
+    def _ext_run(self):
+        '''Return a new, empty run in the spill directory.'''
+        self.runs_written += 1
+        return _Run(os.path.join(self.spill_dir.name, '%d.run' % self.runs_written), self.shared, self.shared_ids)
+
+    def _ext_write(self, records):
+        '''Write records (already in the order of _record_order) to a new run and return it.'''
+        run = self._ext_run()
+        for record in records:
+            run.append(record)
+        run.close()
+        self.bytes_spilled += run.size
+        return run
+
+    def _ext_push(self, fval, record):
+        '''
+        Add a record to the f-layer fval of OPEN. Records are buffered in memory; once there are more
+        than buffer_size, each layer's buffer is sorted and written to disk as a new run of the layer.
+        '''
+        self.buffers.setdefault(fval, []).append(record)
+        self.buffered += 1
+        if self.buffered > self.buffer_size:
+            for layer in list(self.buffers):
+                self._ext_spill(layer)
+
+    def _ext_spill(self, fval):
+        '''Write the buffer of f-layer fval (if any) to a run of the layer.'''
+        records = self.buffers.pop(fval, None)
+        if records:
+            records.sort(key=_record_order)
+            self.layers.setdefault(fval, []).append(self._ext_write(records))
+            self.buffered -= len(records)
+
+    def _ext_unique(self, records):
+        '''
+        Generate the (key, record) pairs of records (in the order of _record_order) with the least
+        g-value for each key, dropping the others.
+        '''
+        for _, group in groupby(records, key=itemgetter(0)):
+            seen = set()
+            for record in group:
+                key = record[3].hashable_state()
+                if key in seen:
+                    self.cycle_check_pruned = self.cycle_check_pruned + 1
+                else:
+                    seen.add(key)
+                    yield key, record
+
+    def _ext_layer(self, fval):
+        '''
+        Delayed duplicate detection for f-layer fval: merge the layer's runs, keep one record for
+        each state, and generate the (key, record) pairs of those not already in the closed runs
+        with a g-value no greater (merging with the closed runs, which are sorted the same way).
+        The layer's runs are removed once they have been read.
+        '''
+        self._ext_spill(fval)
+        runs = self.layers.pop(fval, [])
+        layer = self._ext_unique(heapq.merge(*(run.records() for run in runs), key=_record_order))
+        closed = heapq.merge(*(run.records() for run in self.closed_runs), key=_record_order)
+        closed_record = next(closed, None)
+        for hash_value, group in groupby(layer, key=lambda pair: pair[1][0]):
+            while closed_record is not None and closed_record[0] < hash_value:
+                closed_record = next(closed, None)
+            expanded = dict()
+            while closed_record is not None and closed_record[0] == hash_value:
+                key = closed_record[3].hashable_state()
+                expanded[key] = min(expanded.get(key, math.inf), closed_record[1])
+                closed_record = next(closed, None)
+            for key, record in group:
+                if expanded.get(key, math.inf) <= record[1]:
+                    self.cycle_check_pruned = self.cycle_check_pruned + 1
+                else:
+                    yield key, record
+        for run in runs:
+            run.remove()
+
+    def _ext_compact(self):
+        '''Merge the closed runs into one, keeping one record (the least g-value) for each state.'''
+        runs = self.closed_runs
+        merged = heapq.merge(*(run.records() for run in runs), key=_record_order)
+        self.closed_runs = [self._ext_write(record for _, record in self._ext_unique(merged))]
+        for run in runs:
+            run.remove()
+
+    def _searchExternal(self, goal_fn, heur_fn, costbound):
+        """
+        External-memory A*: OPEN and the closed list are kept on disk as sorted runs, so that the
+        search is bounded by disk space instead of memory. OPEN is split into f-layers. Generated
+        states are buffered in memory and written to their layer as a run sorted on the hash of
+        their key (hashable_state()) whenever the buffers hold more than buffer_size states. The
+        layer with the least f-value is expanded next: its runs are merged, keeping the cheapest
+        copy of each state, and merged again with the closed runs to drop the states that were
+        already expanded (delayed duplicate detection, see _ext_layer). The states expanded are
+        written to a new closed run in the same order, and the closed runs are merged into one
+        when there are more than _CLOSED_RUNS. Successors with the same f-value go back into the
+        layer being expanded, which is repeated until it is empty.
+
+        States are pickled without their parents, with references instead of copies of the objects
+        every state shares (see _shared_objects). A record keeps the hash of its parent's key instead,
+        and the path to a goal is rebuilt from the closed runs (see _ext_path). The first goal
+        extracted is returned, which is optimal for an admissible heuristic.
 
+        @param goal_fn: the goal function.
+        @param heur_fn: the heuristic (a _Heuristic).
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+        """
+        evaluate = heur_fn.evaluate
+        budget = self.budget
+        countdown = budget.interval
+        while True:
+            pending = [fval for fval in self.layers if self.layers[fval]] + list(self.buffers)
+            if not pending:
+                return False
+            fval = min(pending)
+            layer = self._ext_layer(fval)
+            closed = self._ext_run()
+            goal = stopped = None
+            for key, record in layer:
+                _, gval, hval, state, _ = record
+                if _over_bound(costbound, gval, hval):
+                    self.cost_bound_pruned = self.cost_bound_pruned + 1
+                    continue
+                if goal_fn(state):
+                    # closed, so that it is not returned again if the search is resumed
+                    closed.append(record)
+                    goal = record
+                    break
+                countdown -= 1
+                if not countdown:
+                    if budget.check(sNode.n):
+                        stopped = record
+                        break
+                    countdown = budget.interval
+
+                closed.append(record)
+                parent_hash = record[0]
+                for succ in state.successors():
+                    succ_key = succ.hashable_state()
+                    # (the records don't keep the info of an incremental heuristic)
+                    succ_hval = evaluate(succ_key, succ, state, None)[0]
+                    if _over_bound(costbound, succ.gval, succ_hval):
+                        self.cost_bound_pruned = self.cost_bound_pruned + 1
+                        continue
+                    succ.parent = None
+                    # (max: a successor of an inconsistent heuristic is expanded with this layer)
+                    self._ext_push(max(fval, succ.gval + succ_hval),
+                                   (hash(succ_key), succ.gval, succ_hval, succ, parent_hash))
+                    sNode.n = sNode.n + 1
+
+            if goal is not None or stopped is not None:
+                # put the rest of the layer back, it is still in order and free of duplicates
+                rest = (record for _, record in layer)
+                if stopped is not None:
+                    rest = chain([stopped], rest)
+                run = self._ext_write(rest)
+                if run.count:
+                    self.layers.setdefault(fval, []).append(run)
+                else:
+                    run.remove()
+            closed.close()
+            self.bytes_spilled += closed.size
+            if closed.count:
+                self.closed_runs.append(closed)
+            else:
+                closed.remove()
+            if len(self.closed_runs) > _CLOSED_RUNS:
+                self._ext_compact()
+            if goal is not None:
+                return goal
+            if stopped is not None:
+                return False
+
+    def _ext_path(self, record):
+        """
+        Rebuild the path to the state of a goal record of external_astar. The parent of each state
+        is looked up in the closed runs by the hash its record keeps (the cheapest closed state with
+        that hash that has the state as a successor), up to the initial state, and the path is then
+        replayed forwards from the initial state so that each state gets its parent and action.
+        """
+        keys = [record[3].hashable_state()]
+        parent_hash = record[4]
+        while parent_hash is not None:
+            parent = None
+            for run in self.closed_runs:
+                for candidate in run.lookup(parent_hash):
+                    if parent is not None and candidate[1] >= parent[1]:
+                        continue
+                    if any(succ.hashable_state() == keys[-1] for succ in candidate[3].successors()):
+                        parent = candidate
+            keys.append(parent[3].hashable_state())
+            parent_hash = parent[4]
+        state = self.initial_state
+        for key in reversed(keys[:-1]):
+            state = next(succ for succ in state.successors() if succ.hashable_state() == key)
+        return state
+
+    def _searchIDA(self, root, goal_fn, heur_fn, tt_size):
+        """
+        Iterative deepening A* from the root node, as a generator. Each iteration is a depth
+        first search that only expands nodes with f = g + h no greater than a threshold, and the
+        next threshold is the smallest f-value that exceeded it. Memory is linear in the depth of
+        the search: besides the current path only the (optional) transposition table is kept.
+
+        The generator yields a goal node when it finds one and resumes the depth first search
+        after it when next is called again, so like the other strategies the search can be
+        continued (with a tighter costbound) after a goal is found. Goals are yielded once: in
+        later iterations a goal is only yielded if its path has a node with f above the previous
+        threshold, i.e., if the previous iteration could not have reached it. It yields False
+        when the time bound set by search is exceeded, and stops when no node is left under
+        the costbound.
+
+        @param root: the sNode of the initial state.
+        @param goal_fn: the goal function.
+        @param heur_fn: the heuristic (a _Heuristic).
+        @param tt_size: the number of states the transposition table may hold. The table records
+            the least g-value each state was expanded with during the current iteration, and a state
+            reached again with no smaller g-value is pruned. Once full no states are added.
+        """
+        evaluate = heur_fn.evaluate
+        path_check = self.cycle_check != _CC_NONE
+        previous_threshold = -math.inf
+        threshold = root.gval + root.hval
+        # (the generator only runs inside search, which has set self.budget)
+        countdown = self.budget.interval
+
+        while threshold < math.inf:
+            # BEGIN TRACING
+            if self.trace:
+                print("   TRACE: IDA* iteration with f-value threshold", threshold)
+            # END TRACING
+            # [threshold, states expanded, states generated], kept up to date whenever the search suspends
+            iteration = [threshold, 0, 0]
+            self.iterations.append(iteration)
+            generated_before = StateSpace.n
+            next_threshold = math.inf
+            transpositions = dict()
+            root_key = root.state.hashable_state()
+            on_path = {root_key}
+            if goal_fn(root.state) and root.gval + root.hval > previous_threshold:
+                yield root
+                # resumed by the next call to search, with its budget
+                countdown = self.budget.interval
+            # each stack entry is [node, state key, iterator over the node's children, max f on its path]
+            stack = [[root, root_key, None, root.gval + root.hval]]
+
+            while stack:
+                entry = stack[-1]
+                node, key, children, pathmax = entry
+                if children is None:
+                    countdown -= 1
+                    if not countdown:
+                        # (search sets a new budget each time it resumes the generator)
+                        if self.budget.check(sNode.n):
+                            iteration[2] = StateSpace.n - generated_before
+                            yield False
+                        countdown = self.budget.interval
+                    iteration[1] += 1
+                    costbound = self.costbound
+                    candidates = []
+                    for succ in node.state.successors():
+                        succ_key = succ.hashable_state()
+                        if path_check and succ_key in on_path:
+                            self.cycle_check_pruned = self.cycle_check_pruned + 1
+                            continue
+                        if tt_size and transpositions.get(succ_key, math.inf) <= succ.gval:
+                            self.cycle_check_pruned = self.cycle_check_pruned + 1
+                            continue
+                        succ_hval, succ_hinfo = evaluate(succ_key, succ, node.state, node.hinfo)
+                        if _over_bound(costbound, succ.gval, succ_hval):
+                            self.cost_bound_pruned = self.cost_bound_pruned + 1
+                            continue
+                        succ_fval = succ.gval + succ_hval
+                        if succ_fval > threshold:
+                            next_threshold = min(next_threshold, succ_fval)
+                            continue
+                        candidates.append((succ_fval, -succ.gval, len(candidates), succ, succ_key, succ_hval,
+                                           succ_hinfo))
+                    # try the most promising children first (lowest f, then deepest)
+                    candidates.sort()
+                    entry[2] = children = iter(candidates)
+
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    on_path.discard(key)
+                    continue
+                succ_fval, _, _, succ, succ_key, succ_hval, succ_hinfo = child
+                if tt_size and transpositions.get(succ_key, math.inf) <= succ.gval:
+                    # reached through a sibling's subtree since the children were generated
+                    self.cycle_check_pruned = self.cycle_check_pruned + 1
+                    continue
+                succ_node = sNode(succ, succ_hval, node.fval_function, succ_hinfo)
+                succ_pathmax = max(pathmax, succ_fval)
+                if goal_fn(succ):
+                    if succ_pathmax > previous_threshold:
+                        iteration[2] = StateSpace.n - generated_before
+                        yield succ_node
+                        countdown = self.budget.interval
+                    continue
+                if tt_size and (succ_key in transpositions or len(transpositions) < tt_size):
+                    transpositions[succ_key] = succ.gval
+                on_path.add(succ_key)
+                stack.append([succ_node, succ_key, None, succ_pathmax])
+
+            iteration[2] = StateSpace.n - generated_before
+            previous_threshold = threshold
+            threshold = next_threshold
+
+    def _searchHDA(self, timebound, costbound):
+        """
+        Hash distributed A* (HDA*): an astar search spread over self.workers processes. Every
+        state has an owner, the worker numbered hash(hashable_state()) modulo the number of
+        workers, and only its owner keeps it on OPEN, checks it for cycles and expands it, so the
+        workers share no memory. A worker sends the successors it generates for other workers to
+        their owners through a multiprocessing queue, batch_size at a time, and checks its own
+        queue between batches of expansions.
+
+        A goal extracted by a worker is reported to this process, which sends its cost C to all
+        workers as a bound. As C is only known to be optimal once no worker has a node with
+        f < C on OPEN and no successors are in transit, this process detects termination with
+        waves of probes: every worker answers a probe with whether it is idle (no node with
+        f < C to expand and nothing left to send) and the number of batches it has sent and
+        received. The search is over once two consecutive waves find every worker idle with the
+        same counts and as many batches received as sent. Given an admissible heuristic the
+        solution is then optimal, like that of astar.
+
+        Parents are referenced by (worker, index into that worker's table of states), and the
+        goal's path is rebuilt at the end by asking the workers for the states on it. States
+        are sent with their parent set to None, so they must pickle without it, and the workers
+        must agree on hash() (fork, the default start method on Linux, ensures this).
+
+        Stats: states expanded and generated are summed over the workers, and the time is the
+        elapsed (wall clock) time of the search. The search can not be resumed.
+
+        Sets self.hda_timed_out to whether the search stopped at the timebound.
+
+        @param timebound: the maximum amount of (wall clock) time, in seconds, to spend on this search.
+        @param costbound: the cost bound 3-tuple, as described in the assignment.
+        """
+        start_time = os.times()[4]
+        stop_time = start_time + timebound if timebound is not None else None
+        self.hda_timed_out = False
+        workers = self.workers
+        root = self.root
+        if root is None:
+            # already searched
+            return False, SearchStats(0, 0, 0, 0, 0)
+        self.root = None
+
+        inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_hda_worker, daemon=True,
+                                             args=(worker, inboxes, results, self.goal_fn,
+                                                   self.heuristic, costbound, self.batch_size))
+                     for worker in range(workers)]
+        for process in processes:
+            process.start()
+
+        root_state = root.state
+        parent, root_state.parent = root_state.parent, None
+        inboxes[hash(root_state.hashable_state()) % workers].put(('nodes', [(root_state, root.hval, None)]))
+        root_state.parent = parent
+
+        incumbent = None  # (cost, worker, index) of the best goal reported
+        wave = 0
+        answers = dict()
+        previous_counts = None
+        finished = False
+        goal = False
+        try:
+            for inbox in inboxes:
+                inbox.put(('probe', wave))
+            while True:
+                timeout = None
+                if stop_time is not None:
+                    timeout = stop_time - os.times()[4]
+                    if timeout <= 0:
+                        print("TRACE: Search has exceeeded the time bound provided.")
+                        self.hda_timed_out = True
+                        break
+                try:
+                    message = results.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+
+                if message[0] == 'goal':
+                    _, cost, worker, index = message
+                    if incumbent is None or cost < incumbent[0]:
+                        incumbent = (cost, worker, index)
+                        for inbox in inboxes:
+                            inbox.put(('bound', cost))
+                elif message[0] == 'probe' and message[1] == wave:
+                    _, _, worker, idle, sent, received = message
+                    answers[worker] = (idle, sent, received)
+                    if len(answers) < workers:
+                        continue
+                    counts = tuple(answers[worker] for worker in range(workers))
+                    # the root's batch was sent by this process
+                    quiet = (all(idle for idle, _, _ in counts) and
+                             1 + sum(sent for _, sent, _ in counts) == sum(received for _, _, received in counts))
+                    if quiet and counts == previous_counts:
+                        finished = True
+                        break
+                    previous_counts = counts if quiet else None
+                    wave += 1
+                    answers = dict()
+                    for inbox in inboxes:
+                        inbox.put(('probe', wave))
+
+            if finished and incumbent is not None:
+                # follow the parent references back to the root
+                path = []
+                reference = incumbent[1:]
+                while reference is not None:
+                    worker, index = reference
+                    inboxes[worker].put(('trace', index))
+                    message = results.get()
+                    while message[0] != 'trace':
+                        message = results.get()
+                    _, state, reference = message
+                    path.append(state)
+                path.reverse()
+                path[0].parent = root_state.parent
+                for parent, child in zip(path, path[1:]):
+                    child.parent = parent
+                goal = path[-1]
+        finally:
+            stats = [0, 0, 0, 0]
+            for inbox in inboxes:
+                inbox.put(('stop',))
+            reported = 0
+            while reported < workers:
+                try:
+                    message = results.get(timeout=1)
+                except queue.Empty:
+                    break
+                if message[0] == 'stats':
+                    reported += 1
+                    stats = [total + count for total, count in zip(stats, message[1:])]
+            for inbox in inboxes:
+                inbox.cancel_join_thread()
+            for process in processes:
+                process.join(1)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+
+        return goal, SearchStats(*stats, os.times()[4] - start_time)
+
+
+def _hda_worker(worker, inboxes, results, goal_fn, heur_fn, costbound, batch_size):
+    """
+    The loop of an hdastar worker process, see SearchEngine._searchHDA. The messages in its inbox are
+    ('nodes', [(state, hval, parent reference), ...]), ('bound', cost), ('probe', wave), ('trace', index)
+    and ('stop',); the worker puts ('goal', cost, worker, index), ('probe', wave, worker, idle, sent,
+    received), ('trace', state, parent reference) and ('stats', expanded, generated, pruned by cycle
+    checking, pruned by cost) on results.
+    """
+    workers = len(inboxes)
+    inbox = inboxes[worker]
+    open = []  # heap of (f, -g, index)
+    table = []  # index -> (state, parent reference)
+    best = dict()  # hashable_state() -> (least g, index)
+    outboxes = [[] for _ in range(workers)]
+    incumbent = math.inf
+    sent = received = 0
+    expanded = cycle_pruned = cost_pruned = 0
+    generated_before = StateSpace.n
+
+    def add(state, hval, reference):
+        nonlocal cycle_pruned
+        key = state.hashable_state()
+        entry = best.get(key)
+        if entry is not None and entry[0] <= state.gval:
+            cycle_pruned += 1
+            return
+        best[key] = (state.gval, len(table))
+        heapq.heappush(open, (state.gval + hval, -state.gval, len(table)))
+        table.append((state, reference))
+
+    def flush(owner):
+        nonlocal sent
+        if outboxes[owner]:
+            inboxes[owner].put(('nodes', outboxes[owner]))
+            outboxes[owner] = []
+            sent += 1
+
+    while True:
+        busy = open and open[0][0] < incumbent
+        if not busy:
+            for owner in range(workers):
+                flush(owner)
+        block = not busy
+        while True:
+            try:
+                message = inbox.get(block)
+            except queue.Empty:
+                break
+            block = False
+            kind = message[0]
+            if kind == 'nodes':
+                received += 1
+                for state, hval, reference in message[1]:
+                    add(state, hval, reference)
+            elif kind == 'bound':
+                incumbent = min(incumbent, message[1])
+            elif kind == 'probe':
+                idle = not (open and open[0][0] < incumbent) and not any(outboxes)
+                results.put(('probe', message[1], worker, idle, sent, received))
+            elif kind == 'trace':
+                results.put(('trace',) + table[message[1]])
+            elif kind == 'stop':
+                results.put(('stats', expanded, StateSpace.n - generated_before, cycle_pruned, cost_pruned))
+                for other in inboxes:
+                    other.cancel_join_thread()
+                return
+
+        for _ in range(batch_size):
+            if not open or open[0][0] >= incumbent:
+                break
+            _, neg_gval, index = heapq.heappop(open)
+            state, reference = table[index]
+            if best[state.hashable_state()][1] != index:
+                # a cheaper path to the state was found after this one
+                continue
+            if goal_fn(state):
+                incumbent = min(incumbent, state.gval)
+                results.put(('goal', state.gval, worker, index))
+                continue
+            expanded += 1
+            for succ in state.successors():
+                succ.parent = None
+                succ_key = succ.hashable_state()
+                succ_hval = heur_fn.evaluate(succ_key, succ, None, None)[0]
+                if succ.gval + succ_hval >= incumbent or _over_bound(costbound, succ.gval, succ_hval):
+                    cost_pruned += 1
+                    continue
+                owner = hash(succ_key) % workers
+                if owner == worker:
+                    add(succ, succ_hval, (worker, index))
+                else:
+                    outboxes[owner].append((succ, succ_hval, (worker, index)))
+                    if len(outboxes[owner]) >= batch_size:
+                        flush(owner)
+        else:
+            # a full batch of expansions: don't let the other workers wait on a part filled outbox
+            for owner in range(workers):
+                flush(owner)
@@ -1,17 +1,184 @@
 '''Sokoban routines.
-    A) Class SokobanState
+    A) Class Level
+    The static data of a Sokoban puzzle (dimensions, storage points, obstacles and the
+    tables derived from them), shared by every state of the puzzle.
+    B) Class SokobanState
     A specialization of the StateSpace Class that is tailored to the game of Sokoban.
-    B) class Direction
+    C) Class BitboardSokobanState
+    A compact alternative to SokobanState. The level's cells are numbered and the boxes
+    are stored as a single integer bitmask, with the static walls and storage points held
+    as bitmasks by the Level.
+    D) class Direction
     An encoding of the directions of movement that are possible for robots in Sokoban.
+    E) Class Assignment and function min_cost_assignment
+    An O(n^3) minimum cost assignment (Hungarian algorithm), for matching boxes to storage points,
+    that can be repaired in O(n^2) when one box moves.
     Code also contains a list of 20 Sokoban problems for the purpose of testing.
 '''
 
+import math
+from collections import deque
+from functools import cached_property
 from search import *
 
 
+def intern_level(width, height, storage, obstacles):
+    '''
+    @return: The Level of this process with the given static data, created the first time it is asked for.
+    Unpickled Levels go through here, so the states sent from another process share one Level (and its tables).
+    '''
+    data = (width, height, storage, obstacles)
+    level = _interned_levels.get(data)
+    if level is None:
+        level = _interned_levels[data] = Level(width, height, storage, obstacles)
+    return level
+
+
+_interned_levels = {}
+
+
+class Level:
+    '''
+    The static part of a Sokoban puzzle. States only differ in the positions of their robots
+    and boxes, so everything else lives in one Level object that all the states of a puzzle
+    reference, instead of being copied into every state. Tables derived from the static data
+    are computed the first time they are used and then shared as well.
+
+    For the bitboard representation cells are numbered row by row over the room padded with
+    a one cell wall border, so cell (x, y) is (y + 1) * stride + (x + 1) with stride = width + 2.
+    The border and obstacles make up the wall mask, hence moving is just adding a direction
+    offset to a cell number and never needs a bounds check.
+    '''
+
+    def __init__(self, width, height, storage, obstacles):
+        '''
+        @param width: The room's X dimension (excluding walls).
+        @param height: The room's Y dimension (excluding walls).
+        @param storage: A frozenset of all the storage points.
+        @param obstacles: A frozenset of all the impassable obstacles.
+        '''
+        self.width = width
+        self.height = height
+        self.storage = storage
+        self.obstacles = obstacles
+
+    def __reduce__(self):
+        '''Pickle only the static data; the derived tables are rebuilt (once per process) on demand.'''
+        return intern_level, (self.width, self.height, self.storage, self.obstacles)
+
+    @cached_property
+    def stride(self):
+        return self.width + 2
+
+    @cached_property
+    def storage_mask(self):
+        return self.mask(self.storage)
+
+    @cached_property
+    def wall_mask(self):
+        wall_mask = self.mask(self.obstacles)
+        for x in range(-1, self.width + 1):
+            wall_mask |= 1 << self.cell((x, -1)) | 1 << self.cell((x, self.height))
+        for y in range(self.height):
+            wall_mask |= 1 << self.cell((-1, y)) | 1 << self.cell((self.width, y))
+        return wall_mask
+
+    @cached_property
+    def moves(self):
+        '''The (name, cell offset) of each direction of movement.'''
+        return tuple((direction.name, direction.delta[0] + direction.delta[1] * self.stride)
+                     for direction in (UP, RIGHT, DOWN, LEFT))
+
+    @cached_property
+    def floor(self):
+        '''A frozenset of the locations inside the room that are not obstacles.'''
+        return frozenset((x, y) for x in range(self.width) for y in range(self.height)
+                         if (x, y) not in self.obstacles)
+
+    @cached_property
+    def push_distances(self):
+        '''
+        A dictionary mapping each storage point to a dictionary from floor locations to the least
+        number of pushes that moves a box from that location onto the storage point, respecting the
+        obstacles and walls but ignoring the other boxes and robots (so it never overestimates).
+        Found by running the game backwards from the storage point: a box is pulled in each direction
+        where the robot can stand on the two locations in that direction. Locations missing from a
+        storage point's dictionary can never be pushed onto it.
+        '''
+        floor = self.floor
+        push_distances = dict()
+        for storage_point in self.storage:
+            if storage_point not in floor:
+                continue
+            distances = {storage_point: 0}
+            frontier = deque((storage_point,))
+            while frontier:
+                box = frontier.popleft()
+                for direction in (UP, RIGHT, DOWN, LEFT):
+                    pulled = direction.move(box)
+                    if pulled not in distances and pulled in floor and direction.move(pulled) in floor:
+                        distances[pulled] = distances[box] + 1
+                        frontier.append(pulled)
+            push_distances[storage_point] = distances
+        return push_distances
+
+    @cached_property
+    def nearest_storage_distances(self):
+        '''A dictionary from floor locations to the push distance of the nearest storage point (live squares only).'''
+        nearest = dict()
+        for distances in self.push_distances.values():
+            for location, distance in distances.items():
+                if distance < nearest.get(location, distance + 1):
+                    nearest[location] = distance
+        return nearest
+
+    def push_distance(self, box, storage_point):
+        '''@return: The push distance from box to storage_point (see push_distances), infinite if it cannot get there.'''
+        return self.push_distances[storage_point].get(box, math.inf)
+
+    @cached_property
+    def dead_squares(self):
+        '''
+        A frozenset of the floor locations from which no box can ever be pushed to any storage point,
+        i.e., the floor locations that no storage point's push distance table reaches. A box pushed
+        onto one of them can never be stored, whatever the other boxes and robots do.
+        '''
+        return self.floor - self.nearest_storage_distances.keys()
+
+    @cached_property
+    def dead_mask(self):
+        '''The dead squares as a bitmask of cell numbers.'''
+        return self.mask(self.dead_squares)
+
+    def cell(self, location):
+        '''@return: The cell number of an (x, y) location.'''
+        return (location[1] + 1) * self.stride + location[0] + 1
+
+    def location(self, cell):
+        '''@return: The (x, y) location of a cell number.'''
+        return (cell % self.stride - 1, cell // self.stride - 1)
+
+    def mask(self, locations):
+        '''@return: The bitmask with the bit of each of the given (x, y) locations set.'''
+        mask = 0
+        for location in locations:
+            mask |= 1 << self.cell(location)
+        return mask
+
+    def locations(self, mask):
+        '''@return: A frozenset of the (x, y) locations of the bits set in mask.'''
+        locations = []
+        while mask:
+            low = mask & -mask
+            locations.append(self.location(low.bit_length() - 1))
+            mask ^= low
+        return frozenset(locations)
+
+
 class SokobanState(StateSpace):
+    __slots__ = ('level', 'robots', 'boxes')
 
-    def __init__(self, action, gval, parent, width, height, robots, boxes, storage, obstacles):
+    def __init__(self, action, gval, parent, width, height, robots, boxes, storage, obstacles, level=None):
         '''
         Creates a new Sokoban state.
         @param width: The room's X dimension (excluding walls).
@@ -20,14 +187,30 @@ class SokobanState(StateSpace):
         @param boxes: A frozenset of all the boxes.
         @param storage: A frozenset of all the storage points.
         @param obstacles: A frozenset of all the impassable obstacles.
+        @param level: The Level shared with the parent. If given, width, height, storage and obstacles are ignored.
         '''
         StateSpace.__init__(self, action, gval, parent)
-        self.width = width
-        self.height = height
+        if level is None:
+            level = Level(width, height, storage, obstacles)
+        self.level = level
         self.robots = robots
         self.boxes = boxes
-        self.storage = storage
-        self.obstacles = obstacles
+
+    @property
+    def width(self):
+        return self.level.width
+
+    @property
+    def height(self):
+        return self.level.height
+
+    @property
+    def storage(self):
+        return self.level.storage
+
+    @property
+    def obstacles(self):
+        return self.level.obstacles
 
     def successors(self):
         '''
@@ -36,6 +219,7 @@ class SokobanState(StateSpace):
         successors = []
         transition_cost = 1
         moved_boxes = frozenset()
+        dead_squares = self.level.dead_squares
 
         for robot in range(0, len(self.robots)):
             for direction in (UP, RIGHT, DOWN, LEFT):
@@ -43,7 +227,7 @@ class SokobanState(StateSpace):
                 new_robots = list(self.robots);
                 new_robots.remove(self.robots[robot])
                 new_robots = tuple(new_robots)
-                new_boxes = set(self.boxes)
+                new_boxes = self.boxes
                 new_moved_boxes = set(moved_boxes)
 
                 if new_location[0] < 0 or new_location[0] >= self.width:
@@ -70,9 +254,13 @@ class SokobanState(StateSpace):
                         continue
                     if new_box_location in new_boxes:
                         continue
+                    if new_box_location in dead_squares:
+                        continue
 
+                    new_boxes = set(self.boxes)
                     new_boxes.remove(new_location)
                     new_boxes.add(new_box_location)
+                    new_boxes = frozenset(new_boxes)
                     new_moved_boxes.add(new_box_location)
 
                 new_robots = list(self.robots)
@@ -80,15 +268,18 @@ class SokobanState(StateSpace):
                 new_robots = tuple(new_robots)
 
                 new_state = SokobanState(str(robot) + " " + direction.name, self.gval + transition_cost, self,
-                                         self.width, self.height, new_robots, frozenset(new_boxes), self.storage,
-                                         self.obstacles)
+                                         None, None, new_robots, new_boxes, None, None, self.level)
                 successors.append(new_state)
 
         return successors
 
     def hashable_state(self):
-        '''Return a data item that can be used as a dictionary key to UNIQUELY represent a state.'''
-        return hash((self.robots, self.boxes))
+        '''
+        Return a data item that can be used as a dictionary key to UNIQUELY represent a state.
+        Equal keys mean equal robots and boxes, so distinct states are never merged. Successors that
+        do not push a box share their parent's boxes frozenset, whose hash CPython caches.
+        '''
+        return (self.robots, self.boxes)
 
     def state_string(self):
         '''Returns a string representation fo a state that can be printed to stdout.'''
@@ -135,15 +326,253 @@ class SokobanState(StateSpace):
         print("ACTION was " + self.action)
         print(self.state_string())
 
+class BitboardSokobanState(StateSpace):
+    __slots__ = ('level', 'robot_cells', 'box_mask', 'robot_mask')
+
+    def __init__(self, action, gval, parent, level, robots, box_mask, robot_mask=None):
+        '''
+        Creates a new bitboard Sokoban state.
+        @param level: The Level of the puzzle.
+        @param robots: A tuple of the robots' cell numbers. Each robot is denoted by its index in the tuple.
+        @param box_mask: A bitmask of the cells holding boxes.
+        @param robot_mask: A bitmask of the cells holding robots (computed from robots if not given).
+        '''
+        StateSpace.__init__(self, action, gval, parent)
+        self.level = level
+        self.robot_cells = robots
+        self.box_mask = box_mask
+        if robot_mask is None:
+            robot_mask = 0
+            for cell in robots:
+                robot_mask |= 1 << cell
+        self.robot_mask = robot_mask
+
+    @classmethod
+    def from_state(cls, state):
+        '''Returns the bitboard equivalent of a SokobanState.'''
+        level = state.level
+        return cls(state.action, state.gval, None, level, tuple(level.cell(robot) for robot in state.robots),
+                   level.mask(state.boxes))
+
+    def to_state(self):
+        '''Returns the SokobanState equivalent of this state (without its parent).'''
+        return SokobanState(self.action, self.gval, None, None, None, self.robots, self.boxes, None, None,
+                            self.level)
+
+    def successors(self):
+        '''
+        Generates all the actions that can be performed from this state, and the states those actions will create.
+        '''
+        successors = []
+        transition_cost = 1
+        level = self.level
+        walls = level.wall_mask
+        boxes = self.box_mask
+        robot_mask = self.robot_mask
+        blocked = walls | robot_mask
+        push_blocked = blocked | boxes | level.dead_mask
+
+        for robot, cell in enumerate(self.robot_cells):
+            for name, delta in level.moves:
+                new_cell = cell + delta
+                new_bit = 1 << new_cell
+                if blocked & new_bit:
+                    continue
+
+                new_boxes = boxes
+                if boxes & new_bit:
+                    new_box_bit = 1 << (new_cell + delta)
+                    if push_blocked & new_box_bit:
+                        continue
+                    new_boxes = boxes ^ new_bit ^ new_box_bit
+
+                new_robots = self.robot_cells[:robot] + (new_cell,) + self.robot_cells[robot + 1:]
+                successors.append(BitboardSokobanState(str(robot) + " " + name, self.gval + transition_cost, self,
+                                                       level, new_robots, new_boxes,
+                                                       robot_mask ^ (1 << cell) ^ new_bit))
+
+        return successors
+
+    def hashable_state(self):
+        '''Return a data item that can be used as a dictionary key to UNIQUELY represent a state.'''
+        return (self.robot_cells, self.box_mask)
+
+    @property
+    def width(self):
+        return self.level.width
+
+    @property
+    def height(self):
+        return self.level.height
+
+    @property
+    def storage(self):
+        return self.level.storage
+
+    @property
+    def obstacles(self):
+        return self.level.obstacles
+
+    @property
+    def robots(self):
+        '''The robots' (x, y) locations, for code written against SokobanState.'''
+        return tuple(self.level.location(cell) for cell in self.robot_cells)
+
+    @property
+    def boxes(self):
+        '''The boxes' (x, y) locations, for code written against SokobanState.'''
+        return self.level.locations(self.box_mask)
+
+    def state_string(self):
+        '''Returns a string representation fo a state that can be printed to stdout.'''
+        return self.to_state().state_string()
+
+    def print_state(self):
+        '''
+        Prints the string representation of the state. ASCII art FTW!
+        '''
+        print("ACTION was " + self.action)
+        print(self.state_string())
+
+
 def sokoban_goal_state(state):
     '''Returns True if we have reached a goal state'''
     '''INPUT: a sokoban state'''
     '''OUTPUT: True (if goal) or False (if not)'''
+    if isinstance(state, BitboardSokobanState):
+        return not state.box_mask & ~state.level.storage_mask
     for box in state.boxes:
         if box not in state.storage:
             return False
     return True
 
+class Assignment:
+    '''
+    A minimum cost assignment of rows to columns, solved with the Hungarian algorithm (shortest
+    augmenting paths with dual potentials) in O(n^3) rather than by enumerating permutations.
+    The cost matrix is made square with zero cost rows. The potentials are kept so that when the
+    costs of a single row change, replace_row can repair the optimum with one augmenting path in
+    O(n^2) instead of solving again. Assignment objects are never modified once built, so one can
+    be shared by a parent state and all of its successors.
+    '''
+
+    def __init__(self, cost=None):
+        '''
+        @param cost: A list of n rows of m >= n costs each. An infinite cost means the row cannot take that column.
+        '''
+        if cost is None:
+            return
+        self.n = len(cost)
+        self.m = len(cost[0]) if cost else 0
+        self.cost = [list(row) for row in cost] + [[0] * self.m for _ in range(self.m - self.n)]
+        self.total = math.inf
+        if self.n > self.m:
+            return
+        # rows and columns are numbered from 1, column 0 is the root of the alternating tree
+        self.u = [0] * (self.m + 1)
+        self.v = [0] * (self.m + 1)
+        self.row_of = [0] * (self.m + 1)
+        for row in range(1, self.m + 1):
+            if not self._augment(row):
+                return
+        self.total = self._assigned_cost()
+
+    @property
+    def assignment(self):
+        '''A list giving the column assigned to each (unpadded) row, or None if every assignment is infinite.'''
+        if self.total == math.inf:
+            return None
+        assignment = [0] * self.n
+        for j in range(1, self.m + 1):
+            if self.row_of[j] <= self.n:
+                assignment[self.row_of[j] - 1] = j - 1
+        return assignment
+
+    def _assigned_cost(self):
+        return sum(self.cost[self.row_of[j] - 1][j - 1] for j in range(1, self.m + 1))
+
+    def _augment(self, row):
+        '''Assigns the unassigned row along a shortest augmenting path. Returns False if there is none.'''
+        m = self.m
+        u = self.u
+        v = self.v
+        row_of = self.row_of
+        way = [0] * (m + 1)
+        row_of[0] = row
+        col = 0
+        min_slack = [math.inf] * (m + 1)
+        used = [False] * (m + 1)
+        while row_of[col] != 0:
+            used[col] = True
+            current = row_of[col]
+            costs = self.cost[current - 1]
+            delta = math.inf
+            next_col = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    slack = costs[j - 1] - u[current] - v[j]
+                    if slack < min_slack[j]:
+                        min_slack[j] = slack
+                        way[j] = col
+                    if min_slack[j] < delta:
+                        delta = min_slack[j]
+                        next_col = j
+            if delta == math.inf:
+                # no finite edge leaves the tree, so this row can never be assigned
+                return False
+            for j in range(m + 1):
+                if used[j]:
+                    u[row_of[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            col = next_col
+        while col:
+            previous = way[col]
+            row_of[col] = row_of[previous]
+            col = previous
+        return True
+
+    def replace_row(self, i, costs):
+        '''
+        @return: A new Assignment for the same costs except that row i's costs are replaced by costs.
+        '''
+        if self.total == math.inf:
+            # nothing to repair, solve from scratch
+            cost = self.cost[:self.n]
+            cost[i] = costs
+            return Assignment(cost)
+        repaired = Assignment()
+        repaired.n = self.n
+        repaired.m = self.m
+        repaired.cost = list(self.cost)
+        repaired.cost[i] = costs
+        repaired.u = list(self.u)
+        repaired.v = list(self.v)
+        repaired.row_of = list(self.row_of)
+        repaired.total = math.inf
+        row = i + 1
+        # free the row's column, and lower its potential so that no reduced cost becomes negative
+        repaired.row_of[repaired.row_of.index(row, 1)] = 0
+        repaired.u[row] = min(costs[j - 1] - repaired.v[j] for j in range(1, self.m + 1))
+        if repaired.u[row] == math.inf or not repaired._augment(row):
+            return repaired
+        repaired.total = repaired._assigned_cost()
+        return repaired
+
+
+def min_cost_assignment(cost):
+    '''
+    Solves the assignment problem (see Assignment).
+    @param cost: A list of n rows of m >= n costs each. An infinite cost means the row cannot take that column.
+    @return: A pair (total cost, assignment) where assignment[i] is the column given to row i and the
+             total cost is minimal, or (math.inf, None) if every assignment has an infinite cost.
+    '''
+    if not cost:
+        return 0, []
+    solved = Assignment(cost)
+    return solved.total, solved.assignment
+
 '''
 Sokoban Problem Set, for testing
 '''
@@ -5,11 +5,14 @@
 #   You may not remove any imports.
 #   You may not import or otherwise source any of your own files
 
-import itertools
 import os  # for time functions
 import math  # for infinity
+import multiprocessing  # for portfolio search
+import queue
+import time
+import copy
 from search import *  # for search engines
-from sokoban import sokoban_goal_state, SokobanState, Direction, PROBLEMS, UP, DOWN, RIGHT, LEFT  # for Sokoban specific classes and problems
+from sokoban import sokoban_goal_state, SokobanState, Direction, PROBLEMS, UP, DOWN, RIGHT, LEFT, min_cost_assignment, Assignment  # for Sokoban specific classes and problems
 
 # SOKOBAN HEURISTICS
 def heur_alternate(state):
@@ -29,9 +32,11 @@ def heur_alternate(state):
         
     obstacles = identify_obstacle(state)
     
-    if has_box_at_corner(state.boxes, state.storage, obstacles):
+    # Successors never push a box onto a dead square (see Level.dead_squares), which include
+    # every corner that is not a storage point, so only a box that starts on one is caught here.
+    if has_box_on_dead_square(state):
         if trace:
-            print("evalutaed to: ", math.inf, "by corner")
+            print("evalutaed to: ", math.inf, "by dead square")
         return math.inf
     
     if has_unmovable_box(state, obstacles):
@@ -49,7 +54,7 @@ def heur_alternate(state):
             print("evalutaed to: ", math.inf, "by box aggregate")
         return math.inf
 
-    box_to_goal_min_dist, pairs = minimum_manhattan_pairs_distance(state, obstacles)
+    box_to_goal_min_dist, pairs = minimum_push_pairs_distance(state)
     
     if edge_unspecificity_deadlock(pairs, state):
         if trace:
@@ -93,6 +98,67 @@ def heur_manhattan_distance(state):
         min(abs(bx - sx) + abs(by - sy) for (sx, sy) in state.storage) for (bx, by) in state.boxes
     )
 
+def heur_push_distance(state):
+    '''admissible sokoban puzzle heuristic: push distance'''
+    '''INPUT: a sokoban state'''
+    '''OUTPUT: a numeric value that serves as an estimate of the distance of the state to the goal.'''
+    # Like heur_manhattan_distance, but each box contributes the least number of pushes needed to get it
+    # onto its nearest storage point around the obstacles (Level.push_distances), looked up in O(1).
+    # Boxes that cannot reach any storage point make the estimate infinite.
+    nearest = state.level.nearest_storage_distances
+    return sum(nearest.get(box, math.inf) for box in state.boxes)
+
+def heur_matching_distance(state):
+    '''admissible sokoban puzzle heuristic: minimum cost box to storage matching'''
+    '''INPUT: a sokoban state'''
+    '''OUTPUT: a numeric value that serves as an estimate of the distance of the state to the goal.'''
+    # Each storage point holds one box, so instead of sending every box to its nearest storage point
+    # we take the cheapest one to one assignment of boxes to storage points under push distances,
+    # found with the Hungarian algorithm (min_cost_assignment) in O(n^3).
+    return minimum_push_pairs_distance(state)[0]
+
+class IncrementalPushDistance(IncrementalHeuristic):
+    '''heur_push_distance, updated from the parent's value by the change in the pushed box's distance (O(1)).'''
+    
+    def evaluate(self, state, parent, parent_info):
+        if parent_info is not None:
+            pushed = pushed_box(state, parent)
+            if pushed is None:
+                return parent_info, parent_info
+            if pushed:
+                nearest = state.level.nearest_storage_distances
+                hval = parent_info - nearest.get(pushed[0], math.inf) + nearest.get(pushed[1], math.inf)
+                if hval == hval:  # not inf - inf
+                    return hval, hval
+        hval = heur_push_distance(state)
+        return hval, hval
+
+
+class IncrementalMatchingDistance(IncrementalHeuristic):
+    '''heur_matching_distance, repairing the parent's matching when a box is pushed (O(n^2) instead of O(n^3)).'''
+    
+    def evaluate(self, state, parent, parent_info):
+        goals = list(state.storage)
+        push_distance = state.level.push_distance
+        if parent_info is not None:
+            boxes, matching = parent_info
+            pushed = pushed_box(state, parent)
+            if pushed is None:
+                return matching.total, parent_info
+            if pushed:
+                i = boxes.index(pushed[0])
+                boxes = list(boxes)
+                boxes[i] = pushed[1]
+                matching = matching.replace_row(i, [push_distance(pushed[1], goal) for goal in goals])
+                return matching.total, (boxes, matching)
+        boxes = list(state.boxes)
+        matching = Assignment([[push_distance(box, goal) for goal in goals] for box in boxes])
+        return matching.total, (boxes, matching)
+
+
+heur_push_distance_incremental = IncrementalPushDistance()
+heur_matching_distance_incremental = IncrementalMatchingDistance()
+
 def fval_function(sN, weight):
     # IMPLEMENT
     """
@@ -106,10 +172,12 @@ def fval_function(sN, weight):
     return sN.gval + weight * sN.hval  # CHANGE THIS
 
 # SEARCH ALGORITHMS
-def weighted_astar(initial_state, heur_fn, weight, timebound):
+def weighted_astar(initial_state, heur_fn, weight, timebound, budget=None, on_solution=None):
     # IMPLEMENT    
     '''Provides an implementation of weighted a-star, as described in the HW1 handout'''
     '''INPUT: a sokoban state that represents the start state and a timebound (number of seconds)'''
+    '''       optionally a SearchBudget to use instead of the timebound and a function to call with'''
+    '''       each solution found and its SearchStats (as for all the algorithms below)'''
     '''OUTPUT: A goal state (if a goal is found), else False as well as a SearchStats object'''
     '''implementation of weighted astar algorithm'''
     
@@ -118,63 +186,200 @@ def weighted_astar(initial_state, heur_fn, weight, timebound):
     wrapped_fval_function = (lambda sN: fval_function(sN, weight))
     
     se.init_search(initial_state, sokoban_goal_state, heur_fn, wrapped_fval_function)
-    result = se.search(timebound=timebound)
+    if budget is None:
+        result = se.search(timebound=timebound)
+    else:
+        result = se.search(budget=budget)
+    if result[0] and on_solution is not None:
+        on_solution(*result)
     
     return result 
 
-def iterative_astar(initial_state, heur_fn, weight=1, timebound=5):  # uses f(n), see how autograder initializes a search line 88
+def iterative_astar(initial_state, heur_fn, weight=1, timebound=5, budget=None, on_solution=None):  # uses f(n), see how autograder initializes a search line 88
     # IMPLEMENT
     '''Provides an implementation of realtime a-star, as described in the HW1 handout'''
     '''INPUT: a sokoban state that represents the start state and a timebound (number of seconds)'''
     '''OUTPUT: A goal state (if a goal is found), else False as well as a SearchStats object'''
     '''implementation of iterative astar algorithm'''
     
-    stoptime = get_stoptime(timebound)
+    # one budget for all the searches, so together they stay within the timebound
+    if budget is None:
+        budget = SearchBudget(cpu_time=timebound)
+    budget.start()
     
     se = SearchEngine('custom', 'default') # Note: Should it be something other than default?
     wrapped_fval_function = (lambda sN: fval_function(sN, weight))
     se.init_search(initial_state, sokoban_goal_state, heur_fn, wrapped_fval_function)
     
     curr_best = False
-    result, stat = se.search(get_timebound(stoptime))
+    result, stat = se.search(budget=budget)
     while result:
         curr_best = result
-        result, stat = se.search(get_timebound(stoptime), costbound=(math.inf, math.inf, curr_best.gval))
+        if on_solution is not None:
+            on_solution(curr_best, stat)
+        costbound = (math.inf, math.inf, curr_best.gval)
+        se.tighten_bound(costbound)
+        result, stat = se.search(costbound=costbound, budget=budget)
     
     return curr_best, stat
         
         
-def iterative_gbfs(initial_state, heur_fn, timebound=5):  # only use h(n)
+def iterative_arastar(initial_state, heur_fn, weight=10, timebound=5, budget=None, on_solution=None):
+    '''Provides an implementation of Anytime Repairing A* (ARA*)'''
+    '''INPUT: a sokoban state that represents the start state and a timebound (number of seconds)'''
+    '''OUTPUT: A goal state (if a goal is found), else False as well as a SearchStats object'''
+    '''implementation of anytime repairing astar algorithm'''
+    # Unlike iterative_astar, each solution lowers the weight (halving its excess over 1), and the
+    # engine repairs its existing OPEN for the new weight rather than searching again from scratch.
+    
+    if budget is None:
+        budget = SearchBudget(cpu_time=timebound)
+    budget.start()
+    
+    se = SearchEngine('arastar', 'full')
+    se.init_search(initial_state, sokoban_goal_state, heur_fn, weight=weight)
+    
+    curr_best = False
+    while True:
+        result, stat = se.search(budget=budget)
+        if result:
+            curr_best = result
+            if on_solution is not None:
+                on_solution(curr_best, stat)
+        elif stat.limit_reached:
+            break
+        if weight == 1:
+            if not result:
+                break
+        else:
+            weight = 1 + (weight - 1) / 2
+            if weight < 1.1:
+                weight = 1
+            se.set_weight(weight)
+    
+    return curr_best, stat
+
+
+def iterative_gbfs(initial_state, heur_fn, timebound=5, budget=None, on_solution=None):  # only use h(n)
     # IMPLEMENT
     '''Provides an implementation of anytime greedy best-first search, as described in the HW1 handout'''
     '''INPUT: a sokoban state that represents the start state and a timebound (number of seconds)'''
     '''OUTPUT: A goal state (if a goal is found), else False'''
     '''implementation of iterative gbfs algorithm'''
     
-    stoptime = get_stoptime(timebound)
+    if budget is None:
+        budget = SearchBudget(cpu_time=timebound)
+    budget.start()
     
     se = SearchEngine('best_first', 'default') # Note: Should it be something other than default?
     se.init_search(initial_state, sokoban_goal_state, heur_fn)
     
     curr_best = False
-    result, stat = se.search(get_timebound(stoptime))
+    result, stat = se.search(budget=budget)
     while result:
         curr_best = result
-        result, stat = se.search(get_timebound(stoptime), costbound=(curr_best.gval, math.inf, math.inf))
+        if on_solution is not None:
+            on_solution(curr_best, stat)
+        costbound = (curr_best.gval, math.inf, math.inf)
+        se.tighten_bound(costbound)
+        result, stat = se.search(costbound=costbound, budget=budget)
     
     return curr_best, stat
 
-def get_stoptime(timebound):
-    start = os.times()[0]
-    stop = None
-    if timebound:
-        stop = start + timebound
-    return stop
-    
-def get_timebound(stoptime):
-    starttime = os.times()[0]
-    return stoptime - starttime
-    
+def portfolio_search(initial_state, configurations=None, timebound=5, mode='best', processes=None):
+    '''Runs several search configurations at once, each in its own process'''
+    '''INPUT: a sokoban state that represents the start state, a list of (algorithm, heur_fn, weight) configurations,'''
+    '''       a timebound (number of seconds), mode 'first' or 'best' and the number of processes'''
+    '''OUTPUT: A goal state (if a goal is found), else False as well as a SearchStats object'''
+    # Which algorithm does best varies from level to level, so rather than guessing we race them on
+    # separate cores. Each configuration names one of the search algorithms above (weighted_astar,
+    # iterative_astar, iterative_arastar or iterative_gbfs, whose weight is ignored), a heuristic and a
+    # weight; all of them must be module level objects so they can be sent to a worker process.
+    # Workers search within a wall clock budget and report every improved solution as they find it.
+    # In 'first' mode the first solution reported wins, in 'best' mode the cheapest one reported
+    # within the timebound, including those of workers that are terminated at the deadline.
+    # At most processes configurations (default: one per CPU) run at the same time; when they have
+    # to take turns, each gets its share of the remaining time so that all of them get to run.
+    
+    if configurations is None:
+        configurations = [(iterative_astar, heur_alternate, 10),
+                          (iterative_gbfs, heur_alternate, None),
+                          (iterative_arastar, heur_matching_distance_incremental, 10),
+                          (weighted_astar, heur_alternate, 5)]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    
+    deadline = time.monotonic() + timebound
+    results = multiprocessing.Queue()
+    pending = list(enumerate(configurations))
+    running = dict()
+    best, best_stats, last_stats = False, None, None
+    
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    pending = []
+                    break
+                turns = math.ceil(len(pending) / processes)
+                index, (algorithm, heur_fn, weight) = pending.pop(0)
+                worker = multiprocessing.Process(target=_portfolio_worker, daemon=True,
+                                                 args=(index, algorithm, heur_fn, weight, initial_state,
+                                                       remaining / turns, results))
+                worker.start()
+                running[index] = worker
+            if not running:
+                break
+            try:
+                # allow a little slack for the workers to report after their own budget runs out
+                index, path, stats, finished = results.get(timeout=max(0, deadline - time.monotonic()) + 0.5)
+            except queue.Empty:
+                break
+            if finished:
+                running.pop(index).join()
+            last_stats = stats
+            if path and (not best or path[-1].gval < best.gval):
+                best, best_stats = attach_path(path), stats
+                if mode == 'first':
+                    break
+    finally:
+        for worker in running.values():
+            worker.terminate()
+        for worker in running.values():
+            worker.join()
+    
+    if best:
+        return best, best_stats
+    return False, last_stats if last_stats is not None else SearchStats(0, 0, 0, 0, 0)
+
+def _portfolio_worker(index, algorithm, heur_fn, weight, initial_state, timebound, results):
+    budget = SearchBudget(wall_time=timebound)
+    report = lambda solution, stats: results.put((index, detach_path(solution), stats, False))
+    if algorithm is iterative_gbfs:
+        final, stats = algorithm(initial_state, heur_fn, timebound=timebound, budget=budget, on_solution=report)
+    else:
+        final, stats = algorithm(initial_state, heur_fn, weight, timebound, budget=budget, on_solution=report)
+    results.put((index, None, stats, True))
+
+def detach_path(state):
+    '''Returns the list of copies of the states from the initial state to state with their parent links
+    cut, which pickles without recursing down the whole path (see attach_path); the states themselves
+    are left alone, as the search that found them may still be using them'''
+    path = []
+    while state:
+        s = copy.copy(state)
+        s.parent = None
+        path.append(s)
+        state = state.parent
+    path.reverse()
+    return path
+
+def attach_path(path):
+    '''Restores the parent links of a list of states made by detach_path and returns the last state'''
+    for parent, child in zip(path, path[1:]):
+        child.parent = parent
+    return path[-1]
 
 # Helpers
 def identify_obstacle(state):
@@ -190,6 +395,9 @@ def identify_obstacle(state):
         obstacles.add((i, state.height))
     return obstacles
 
+def has_box_on_dead_square(state):
+    return not state.level.dead_squares.isdisjoint(state.boxes)
+
 def has_box_at_corner(boxes, goals, obstacle):
     for box in boxes:
         if is_box_at_corner(box, goals, obstacle):
@@ -383,6 +591,19 @@ def find_min_dist_manhattan_path(box, goal, obstacle):
         return 1 + find_min_dist_manhattan_path(vmove.move(box), goal, obstacle)    
 
 
+def pushed_box(state, parent):
+    '''Returns None if state has the same boxes as parent, the pair (old location, new location) if
+    exactly one box was moved, and False otherwise.'''
+    if state.boxes is parent.boxes:
+        return None
+    old = parent.boxes - state.boxes
+    new = state.boxes - parent.boxes
+    if not old and not new:
+        return None
+    if len(old) != 1 or len(new) != 1:
+        return False
+    return next(iter(old)), next(iter(new))
+
 def non_goal_box(state):
     return [box for box in state.boxes if box not in state.storage]
 
@@ -393,13 +614,7 @@ def sum_min_dist_manhattan_path(boxes, goals, obstacle):
     
     distance = [[manhattan(box, goal) for goal in goals] for box in boxes]
     
-    for i in range(len(goals) - len(boxes)):
-        distance.append([0] * len(goals))
-    
-    box_permutation = itertools.permutations(list(range(len(goals))))
-    goals = list(range(len(goals)))
-    
-    min_dist = min(sum(distance[boxes[i]][i] for i in goals ) for boxes in box_permutation)
+    min_dist, assignment = min_cost_assignment(distance)
     return min_dist
 
 
@@ -410,27 +625,31 @@ def minimum_manhattan_pairs_distance(state, obstacles):
     
     distance = [[manhattan(box, goal) for goal in goals] for box in boxes]
     
-    for i in range(len(goals) - len(boxes)):
-        distance.append([0] * len(goals))
+    return minimum_pairs_distance(distance, goals, boxes)
+
+
+def minimum_push_pairs_distance(state):
     
-    box_permutation = itertools.permutations(list(range(len(goals))))
+    goals = list(state.storage)
+    boxes = list(state.boxes)
+    push_distance = state.level.push_distance
     
-    min_dist = math.inf
+    distance = [[push_distance(box, goal) for goal in goals] for box in boxes]
     
+    return minimum_pairs_distance(distance, goals, boxes)
+
+
+def minimum_pairs_distance(distance, goals, boxes):
     
-    for perm in box_permutation:
-        cur_dist = sum(distance[perm[i]][i] for i in range(len(goals)))
-        if cur_dist < min_dist:
-            min_dist = cur_dist
-            min_perm = perm
+    # Hungarian algorithm, O(n^3) instead of trying all n! permutations of the storage points
+    min_dist, assignment = min_cost_assignment(distance)
     
-    pairs = []
-    for i in range(len(min_perm)):
-        if min_perm[i] > len(boxes) - 1:
-            pairs.append((goals[i], None))
-        else:  
-            pairs.append((goals[i], boxes[min_perm[i]]))
+    if assignment is None:
+        # every assignment leaves some box unable to reach its storage point
+        return math.inf, []
     
+    box_of_goal = {goal: boxes[box] for box, goal in enumerate(assignment)}
+    pairs = [(goals[i], box_of_goal.get(i)) for i in range(len(goals))]
     
     return min_dist, pairs
         